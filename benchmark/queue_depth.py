@@ -0,0 +1,79 @@
+# coding=utf-8
+# Scaling benchmark of the controller queue depth: a random trace confined to
+# one channel keeps the queues of that controller full, and it is simulated
+# with the read, write and activate queues set to each depth in turn.
+# Run from the repository root: python -m benchmark.queue_depth
+import os
+import re
+import sys
+import json
+import time
+import random
+import tempfile
+import subprocess
+from typing import List
+from tap import Tap
+
+dirname_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ArgumentParser(Tap):
+    depths: List[int] = [8, 16, 32, 64, 128, 256]
+    num_requests: int = 5000
+    ratio_write: float = 0.3
+    seed: int = 0
+    skip_idle: bool = False
+    output: str = ''  # write the results as JSON to this file
+
+
+def generate_trace(filename, num_requests, ratio_write, seed):
+    # the channel is selected by the bits right above the 64-byte transaction
+    # (RoBaRaCoCh), clear them so that every request goes to channel 0
+    rand = random.Random(seed)
+    with open(filename, 'w') as f:
+        for _ in range(num_requests):
+            addr = rand.getrandbits(32) & ~0x1ff
+            f.write('0x{:08x} {}\n'.format(addr, 'W' if rand.random() < ratio_write else 'R'))
+
+
+def run(trace_filename, depth, skip_idle):
+    command = [sys.executable, 'main.py', '--trace', trace_filename,
+               '--queue_read_depth', str(depth),
+               '--queue_write_depth', str(depth),
+               '--queue_activate_depth', str(depth)]
+    if skip_idle:
+        command.append('--skip_idle')
+    begin = time.perf_counter()
+    out = subprocess.run(command, cwd=dirname_root, capture_output=True, text=True, check=True).stdout
+    seconds = time.perf_counter() - begin
+    return int(re.search(r'#cycle: (\d+)', out).group(1)), seconds
+
+
+def main(args_):
+    results = []
+    with tempfile.TemporaryDirectory() as dirname:
+        # the start-up time of the interpreter is measured on an empty trace
+        # and deducted, so that only the simulation itself is compared
+        trace_filename = os.path.join(dirname, 'empty.trace')
+        open(trace_filename, 'w').close()
+        _, seconds_startup = run(trace_filename, args_.depths[0], args_.skip_idle)
+        
+        trace_filename = os.path.join(dirname, 'channel0.trace')
+        generate_trace(trace_filename, args_.num_requests, args_.ratio_write, args_.seed)
+        print('{:>6} {:>10} {:>10} {:>14}'.format('depth', 'cycles', 'seconds', 'cycles/second'))
+        for depth in args_.depths:
+            num_cycles, seconds = run(trace_filename, depth, args_.skip_idle)
+            seconds = max(seconds - seconds_startup, 1e-6)
+            results.append({'depth': depth, 'cycles': num_cycles, 'seconds': seconds,
+                            'cycles_per_second': num_cycles / seconds})
+            print('{:>6} {:>10} {:>10.2f} {:>14.0f}'.format(depth, num_cycles, seconds, num_cycles / seconds))
+    
+    if args_.output != '':
+        with open(args_.output, 'w') as f:
+            json.dump({'num_requests': args_.num_requests, 'ratio_write': args_.ratio_write,
+                       'seed': args_.seed, 'skip_idle': args_.skip_idle,
+                       'seconds_startup': seconds_startup, 'results': results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main(ArgumentParser().parse_args())
@@ -0,0 +1,174 @@
+# coding=utf-8
+# Throughput of the simulator on synthetic workloads, for every combination of
+# scheduler and row policy. Each point is simulated as main.py would, in a new
+# process, which records the simulated cycles, the requests and cycles simulated
+# per second of wall time of the simulation and its peak RSS.
+# The results of a commit can be compared with those of another one:
+#   python -m benchmark.suite --output after.json --baseline before.json
+# Run from the repository root.
+import os
+import json
+import operator
+import time
+import random
+import tempfile
+import subprocess
+import multiprocessing
+from typing import List
+from tap import Tap
+
+dirname_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+list_workloads = ['streaming', 'random', 'strided', 'row_hits', 'write_heavy', 'bank_conflicts']
+
+
+class ArgumentParser(Tap):
+    workloads: List[str] = list_workloads
+    schedulers: List[str] = ['FCFS', 'FRFCFS', 'FRFCFS_CAP', 'FRFCFS_PriorHit']
+    row_policies: List[str] = ['closed', 'closedAP', 'opened', 'timeout']
+    num_requests: int = 2000
+    ratio_write: float = 0.3  # of every workload but write_heavy
+    stride: int = 4096  # the bytes between the requests of the strided workload
+    seed: int = 0
+    repeat: int = 1  # the runs of every point, of which the fastest counts
+    skip_idle: bool = False
+    output: str = ''  # write the results as JSON to this file
+    baseline: str = ''  # compare the results with those in this JSON file
+    tolerance: float = 0.1  # the relative loss of cycles per second reported as a regression
+
+
+def generate_trace(filename, workload, args_):
+    # the workloads that target banks and rows build their addresses from address lists
+    import main
+    from offchip.memory import Memory, AddressMapping
+    spec = main.get_spec(main.get_args([]))
+    mapping = AddressMapping(spec, Memory.type_)
+    count = spec.org_entry.count
+    level = spec.level
+    num_columns = count[level.column.value] // spec.prefetch_size
+    
+    rand = random.Random(args_.seed)
+    base = rand.getrandbits(32) & ~0xfff
+    # one open row per channel
+    rows_hot = [[rand.randrange(max(count[i], 1)) for i in range(len(count))] for _ in range(count[0])]
+    bank_conflicts = [rand.randrange(max(count[i], 1)) for i in range(len(count))]
+    ratio_write = 0.7 if workload == 'write_heavy' else args_.ratio_write
+    with open(filename, 'w') as f:
+        for i in range(args_.num_requests):
+            if workload == 'streaming':
+                addr = (base + i * 64) & 0xffffffff
+            elif workload in ['random', 'write_heavy']:
+                addr = rand.getrandbits(32) & ~0x3f
+            elif workload == 'strided':
+                addr = (base + i * args_.stride) & 0xffffffff & ~0x3f
+            elif workload == 'row_hits':
+                addr_list = list(rows_hot[rand.randrange(count[0])])
+                addr_list[level.column.value] = rand.randrange(num_columns)
+                addr = mapping.encode(addr_list)
+            elif workload == 'bank_conflicts':
+                # one bank, a different row for every request
+                addr_list = list(bank_conflicts)
+                addr_list[level.row.value] = rand.randrange(count[level.row.value])
+                addr_list[level.column.value] = rand.randrange(num_columns)
+                addr = mapping.encode(addr_list)
+            else:
+                raise Exception(workload)
+            f.write('0x{:08x} {}\n'.format(addr, 'W' if rand.random() < ratio_write else 'R'))
+
+
+def run_point(trace_filename, options):
+    # runs in a fresh worker process: the number of cycles, the seconds of the
+    # simulation and the peak RSS in KiB of the process
+    import main
+    import resource
+    import contextlib
+    args = main.get_args(['--trace', trace_filename] + options)
+    spec = main.get_spec(args)
+    with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+        begin = time.perf_counter()
+        memory = main.simulate(args, spec, main.Trace(trace_filename, cpu_tick=args.cpu_tick, mem_tick=args.mem_tick))
+        seconds = time.perf_counter() - begin
+    return memory.get_num_cycle(), seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(trace_filename, options, repeat):
+    # the best of repeat runs, each in a new process so that the RSS is its own
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for _ in range(repeat):
+        with context.Pool(1) as pool:
+            results.append(pool.apply(run_point, (trace_filename, options)))
+    num_cycles, _, max_rss = results[0]
+    return num_cycles, min(seconds for _, seconds, _ in results), max_rss
+
+
+def compare(results, filename_baseline, tolerance):
+    # the number of points that got slower than the tolerance or changed their cycles
+    with open(filename_baseline, 'r') as f:
+        baseline = json.load(f)
+    key = operator.itemgetter('workload', 'scheduler', 'row_policy')
+    dict_baseline = {key(result): result for result in baseline['results']}
+    print()
+    print('compared with {} ({})'.format(filename_baseline, baseline.get('commit', '')))
+    num_regressions = 0
+    for result in results:
+        result_baseline = dict_baseline.get(key(result))
+        if result_baseline is None:
+            continue
+        speedup = result['cycles_per_second'] / result_baseline['cycles_per_second']
+        status = ''
+        if result['cycles'] != result_baseline['cycles']:
+            status = 'CYCLES CHANGED (was {})'.format(result_baseline['cycles'])
+            num_regressions += 1
+        elif speedup < 1 - tolerance:
+            status = 'SLOWER'
+            num_regressions += 1
+        print('{:<15} {:<16} {:<9} {:>6.2f}x {:>8.0f} KiB  {}'.format(
+            *key(result), speedup, result['max_rss_kib'] - result_baseline['max_rss_kib'], status))
+    return num_regressions
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=dirname_root,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main(args_):
+    results = []
+    with tempfile.TemporaryDirectory() as dirname:
+        print('{:<15} {:<16} {:<9} {:>8} {:>8} {:>14} {:>16} {:>10}'.format(
+            'workload', 'scheduler', 'policy', 'cycles', 'seconds', 'cycles/second', 'requests/second', 'RSS KiB'))
+        for workload in args_.workloads:
+            trace_filename = os.path.join(dirname, workload + '.trace')
+            generate_trace(trace_filename, workload, args_)
+            for scheduler in args_.schedulers:
+                for row_policy in args_.row_policies:
+                    options = ['--scheduler', scheduler, '--row_policy', row_policy]
+                    if args_.skip_idle:
+                        options.append('--skip_idle')
+                    num_cycles, seconds, max_rss = run(trace_filename, options, args_.repeat)
+                    results.append({'workload': workload, 'scheduler': scheduler, 'row_policy': row_policy,
+                                    'cycles': num_cycles, 'seconds': seconds,
+                                    'cycles_per_second': num_cycles / seconds,
+                                    'requests_per_second': args_.num_requests / seconds,
+                                    'max_rss_kib': max_rss})
+                    print('{:<15} {:<16} {:<9} {:>8} {:>8.2f} {:>14.0f} {:>16.0f} {:>10}'.format(
+                        workload, scheduler, row_policy, num_cycles, seconds,
+                        num_cycles / seconds, args_.num_requests / seconds, max_rss))
+    
+    if args_.output != '':
+        with open(args_.output, 'w') as f:
+            json.dump({'commit': get_commit(), 'num_requests': args_.num_requests,
+                       'ratio_write': args_.ratio_write, 'stride': args_.stride, 'seed': args_.seed,
+                       'repeat': args_.repeat, 'skip_idle': args_.skip_idle,
+                       'results': results}, f, indent=4)
+    
+    if args_.baseline != '':
+        return 1 if compare(results, args_.baseline, args_.tolerance) > 0 else 0
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(ArgumentParser().parse_args()))
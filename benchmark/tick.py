@@ -0,0 +1,71 @@
+# coding=utf-8
+# Throughput of the tick-driven Simulator API: a host sends random requests
+# and advances the memory by a fixed number of cycles per call, as a CPU or
+# accelerator model would. Reported are the simulated cycles and the completed
+# requests per second of wall time for each number of cycles per tick.
+# Run from the repository root: python -m benchmark.tick
+import json
+import time
+import random
+from typing import List
+from tap import Tap
+import main
+from offchip.simulator import Simulator
+
+
+class ArgumentParser(Tap):
+    ticks: List[int] = [1, 8, 64, 512]  # the cycles per tick() call
+    num_requests: int = 20000
+    rate: float = 0.5  # the requests offered per memory cycle
+    ratio_write: float = 0.3
+    seed: int = 0
+    output: str = ''  # write the results as JSON to this file
+
+
+def run(args_, num_cycles_tick):
+    sim = Simulator(main.get_args([]))
+    rand = random.Random(args_.seed)
+    requests = [(rand.getrandbits(32) & ~0x3f, 'write' if rand.random() < args_.ratio_write else 'read')
+                for _ in range(args_.num_requests)]
+    
+    begin = time.perf_counter()
+    num_completed = 0
+    i = 0
+    credit = 0.0
+    while i < len(requests):
+        # the requests offered in the coming tick are sent at its start
+        credit += args_.rate * num_cycles_tick
+        while credit >= 1 and i < len(requests):
+            if sim.send(*requests[i]) is None:
+                break
+            credit -= 1
+            i += 1
+        sim.tick(num_cycles_tick)
+        num_completed += sum(1 for _ in sim.completions())
+    sim.drain()
+    num_completed += sum(1 for _ in sim.completions())
+    seconds = time.perf_counter() - begin
+    return sim.get_num_cycle(), num_completed, seconds
+
+
+def main_benchmark(args_):
+    results = []
+    print('{:>6} {:>10} {:>10} {:>14} {:>16}'.format('tick', 'cycles', 'seconds', 'cycles/second', 'requests/second'))
+    for num_cycles_tick in args_.ticks:
+        num_cycles, num_completed, seconds = run(args_, num_cycles_tick)
+        assert num_completed == args_.num_requests
+        results.append({'tick': num_cycles_tick, 'cycles': num_cycles, 'seconds': seconds,
+                        'cycles_per_second': num_cycles / seconds,
+                        'requests_per_second': num_completed / seconds})
+        print('{:>6} {:>10} {:>10.2f} {:>14.0f} {:>16.0f}'.format(
+            num_cycles_tick, num_cycles, seconds, num_cycles / seconds, num_completed / seconds))
+    
+    if args_.output != '':
+        with open(args_.output, 'w') as f:
+            json.dump({'num_requests': args_.num_requests, 'rate': args_.rate,
+                       'ratio_write': args_.ratio_write, 'seed': args_.seed,
+                       'results': results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main_benchmark(ArgumentParser().parse_args())
@@ -0,0 +1,79 @@
+import time
+
+
+class Profiler(object):
+    # Wall-clock time by phase of the simulator. instrument() replaces a method
+    # of an object by a wrapper that charges the time spent in it to a phase,
+    # so a run without --profile pays nothing. The time of a phase excludes the
+    # phases nested in it (e.g., the timing update within issuing a command),
+    # and the time outside every phase is reported as the main loop.
+    phase_main = 'main_loop'
+    
+    def __init__(self):
+        self.seconds = {}  # type: dict
+        self.calls = {}  # type: dict
+        self._stack = [Profiler.phase_main]
+        self._time_begin = time.perf_counter()
+        self._time_last = self._time_begin
+        self._time_end = None
+        self.seconds[Profiler.phase_main] = 0.0
+        self.calls[Profiler.phase_main] = 1
+    
+    def instrument(self, obj, name, phase):
+        method = getattr(obj, name)
+        self.seconds.setdefault(phase, 0.0)
+        self.calls.setdefault(phase, 0)
+        stack = self._stack
+        seconds = self.seconds
+        calls = self.calls
+        perf_counter = time.perf_counter
+        
+        def timed(*args, **kwargs):
+            now = perf_counter()
+            seconds[stack[-1]] += now - self._time_last
+            self._time_last = now
+            stack.append(phase)
+            calls[phase] += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                now = perf_counter()
+                seconds[stack.pop()] += now - self._time_last
+                self._time_last = now
+        
+        setattr(obj, name, timed)
+    
+    def instrument_memory(self, memory):
+        # the phases of the memory, its controllers and their channels
+        self.instrument(memory.mapping, 'decode', 'decode_address')
+        self.instrument(memory.mapping, 'decode_batch', 'decode_address')
+        self.instrument(memory, 'send', 'send')
+        self.instrument(memory, 'get_next_event_cycle', 'next_event')
+        self.instrument(memory, 'finish', 'statistics')
+        for ctrl in memory.ctrls:
+            self.instrument(ctrl, 'cycle', 'controller')
+            self.instrument(ctrl.scheduler, 'get_head', 'scheduler')
+            self.instrument(ctrl.refresh, 'cycle', 'refresh')
+            self.instrument(ctrl, '_issue_cmd', 'issue_cmd')
+            self.instrument(ctrl.channel, 'check', 'dram_check')
+            self.instrument(ctrl.channel, 'decode', 'dram_decode')
+            self.instrument(ctrl.channel, 'update', 'update_timing')
+    
+    def stop(self):
+        now = time.perf_counter()
+        self.seconds[self._stack[-1]] += now - self._time_last
+        self._time_last = now
+        self._time_end = now
+    
+    def get_seconds_total(self):
+        time_end = time.perf_counter() if self._time_end is None else self._time_end
+        return time_end - self._time_begin
+    
+    def print_report(self, num_cycles):
+        # the simulated cycles per second, and the seconds, share and calls of every phase
+        seconds_total = self.get_seconds_total()
+        print('#profile_seconds: {:.3f}'.format(seconds_total))
+        print('#profile_cycles_per_second: {:.0f}'.format(num_cycles / max(seconds_total, 1e-9)))
+        for phase, seconds in sorted(self.seconds.items(), key=lambda item: -item[1]):
+            print('#profile {:<16} {:>9.3f} s {:>6.1f} % {:>10} calls'.format(
+                phase, seconds, 100 * seconds / max(seconds_total, 1e-9), self.calls[phase]))
@@ -1,3 +1,18 @@
+import csv
+import json
+from configs.stat_data_structure import HistogramStatistic, StatisticGroup
+
+# the counters of a controller that add up over the channels
+list_counters_channel = ['_bytes_read', '_bytes_write',
+                         '_hits_row', '_hits_row_read', '_hits_row_write',
+                         '_misses_row', '_misses_row_read', '_misses_row_write',
+                         '_conflicts_row', '_conflicts_row_read', '_conflicts_row_write',
+                         'useless_activates', '_latency_read_sum']
+# the latency histograms of a controller, merged over the channels
+list_histograms_channel = ['_latency_read_histogram', '_latency_write_histogram']
+list_percentiles = [50, 95, 99, 99.9]
+
+
 def print_state_periodically(memory, start, interval=1000, do_print_state=False):
     num_cycle = memory.get_num_cycle()
     if num_cycle > start:
@@ -10,13 +25,229 @@ def print_state_periodically(memory, start, interval=1000, do_print_state=False)
                     print()
 
 
-def early_termination(memory, end, args):
+def get_next_checkpoint(memory, interval, end):
+    # the next cycle that print_state_periodically or early_termination acts on,
+    # which must not be skipped over in the event-driven mode
+    num_cycle = memory.get_num_cycle()
+    return min((num_cycle // interval + 1) * interval, max(end + 1, num_cycle))
+
+
+class IntervalSampler(object):
+    # Every interval cycles, one JSON line with what happened in the window:
+    # the bandwidth in bytes per second, the row hit rate, the average length of
+    # the queues, the refresh and active cycles, and per channel the commands,
+    # bytes, average queue length and refresh cycles. The simulation loop calls
+    # sample() when the memory reaches cycle_next, so the cost is a comparison
+    # per cycle and a pass over the channels per window.
+    def __init__(self, memory, interval, filename):
+        assert interval > 0
+        self.interval = interval
+        self.cycle_next = memory.get_num_cycle() + interval
+        self._tCK = memory.spec.speed_entry.tCK
+        self._file = open(filename, 'w')
+        self._cycle_last = memory.get_num_cycle()
+        self._counters_last = self._get_counters(memory)
+    
+    @staticmethod
+    def _get_counters(memory):
+        # per channel: commands, bytes, row hits, row accesses, queue length sum, refresh cycles
+        counters = []
+        for ctrl in memory.ctrls:
+            # a REF is counted by its rank, a REFSB by its bank
+            nodes = [ctrl.channel]
+            for node in nodes:
+                nodes.extend(node.children)
+            counters.append((ctrl.num_cmds_issued, ctrl._bytes_read + ctrl._bytes_write, ctrl._hits_row,
+                             ctrl._hits_row + ctrl._misses_row + ctrl._conflicts_row, ctrl._req_queue_length_sum,
+                             sum(node._num_cycles_refresh for node in nodes)))
+        return counters, memory._num_cycles_active.scalar
+    
+    def sample(self, memory):
+        num_cycle = memory.get_num_cycle()
+        window = num_cycle - self._cycle_last
+        if window <= 0:
+            return
+        counters, num_cycles_active = self._get_counters(memory)
+        counters_last, num_cycles_active_last = self._counters_last
+        deltas = [[value - value_last for value, value_last in zip(channel, channel_last)]
+                  for channel, channel_last in zip(counters, counters_last)]
+        cmds, num_bytes, hits, accesses, queue_length, refresh = [list(column) for column in zip(*deltas)]
+        record = {'cycle': num_cycle,
+                  'window': window,
+                  'bandwidth': sum(num_bytes) / (window * self._tCK * 1e-9),
+                  'row_hit_rate': 0 if sum(accesses) == 0 else sum(hits) / sum(accesses),
+                  'queue_length': sum(queue_length) / window,
+                  'cycles_refresh': sum(refresh),
+                  'cycles_active': num_cycles_active - num_cycles_active_last,
+                  'channels': {'cmds': cmds,
+                               'bytes': num_bytes,
+                               'queue_length': [length / window for length in queue_length],
+                               'cycles_refresh': refresh}}
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._cycle_last = num_cycle
+        self._counters_last = counters, num_cycles_active
+        self.cycle_next = num_cycle + self.interval
+    
+    def close(self, memory):
+        # the last, possibly shorter, window
+        self.sample(memory)
+        self._file.close()
+
+
+def early_termination(memory, end, args, sampler=None):
     if memory.get_num_cycle() > end:
+        # the command traces and the windows of the sampler are only flushed when closed
+        if sampler is not None:
+            sampler.close(memory)
+        memory.finish()
         print_statistics(memory, args)
         print('The number of cycle larger than', end)
         exit(886)
 
 
+def get_percentiles(histogram):
+    # the mean, the percentiles and the maximum of a latency histogram
+    name = histogram.get_name()
+    stats = {'{}_mean'.format(name): histogram.get_mean()}
+    for percentile in list_percentiles:
+        stats['{}_p{:g}'.format(name, percentile)] = histogram.get_percentile(percentile)
+    stats['{}_max'.format(name)] = 0 if histogram.max is None else histogram.max
+    return stats
+
+
+def merge_histograms(histograms):
+    histogram_merged = HistogramStatistic().set_name(histograms[0].get_name())
+    for histogram in histograms:
+        histogram_merged.merge(histogram)
+    return histogram_merged
+
+
+def get_statistics(memory):
+    # the number of cycles, the counters summed over the channels and the
+    # latency percentiles of all channels
+    stats = {'cycle': memory.get_num_cycle()}
+    for name in list_counters_channel:
+        stats[name.lstrip('_')] = sum(getattr(ctrl, name) for ctrl in memory.ctrls)
+    for name in list_histograms_channel:
+        stats.update(get_percentiles(merge_histograms([getattr(ctrl, name) for ctrl in memory.ctrls])))
+    stats['energy'] = sum(ctrl.power.get_energy() for ctrl in memory.ctrls)
+    stats['energy_per_bit'] = get_energy_per_bit(stats['energy'], stats['bytes_read'] + stats['bytes_write'])
+    stats['energy_calibrated'] = all(ctrl.power.calibrated for ctrl in memory.ctrls)
+    return stats
+
+
+def get_statistic_group_memory(num_cycles, tCK, max_bandwidth, groups_channel):
+    # the statistics tree of the memory over the groups of its channels; the
+    # bandwidths are in bytes per second, tCK is the clock period in ns
+    group = StatisticGroup().set_name('memory')
+    group.add_scalar('num_cycles', num_cycles, 'The number of DRAM cycles simulated')
+    seconds = num_cycles * tCK * 1e-9
+    num_bytes = sum(group_channel.get('bytes_read').scalar + group_channel.get('bytes_write').scalar
+                    for group_channel in groups_channel)
+    bandwidth = 0 if seconds == 0 else num_bytes / seconds
+    group.add_scalar('bandwidth', bandwidth, 'The achieved bandwidth in bytes per second')
+    group.add_scalar('max_bandwidth', max_bandwidth, 'The peak bandwidth in bytes per second')
+    group.add_scalar('bandwidth_utilization', 0 if max_bandwidth == 0 else bandwidth / max_bandwidth,
+                     'The achieved bandwidth over the peak bandwidth')
+    energy = sum(group_channel.get('power').get('energy').scalar for group_channel in groups_channel)
+    group.add_scalar('energy', energy, 'The energy of the DRAM in pJ')
+    group.add_scalar('energy_per_bit', get_energy_per_bit(energy, num_bytes),
+                     'The energy per bit read or written in pJ')
+    for group_channel in groups_channel:
+        group.add(group_channel)
+    return group
+
+
+def get_energy_per_bit(energy, num_bytes):
+    return 0 if num_bytes == 0 else energy / (num_bytes * 8)
+
+
+def get_statistic_group(memory):
+    group = get_statistic_group_memory(memory.get_num_cycle(), memory.spec.speed_entry.tCK,
+                                       memory._max_bandwidth.scalar,
+                                       [ctrl.get_statistic_group() for ctrl in memory.ctrls])
+    # inserted after num_cycles, as only a serial run knows the activity of all
+    # channels and the requests accepted by the memory
+    group.statistics[1:1] = [memory._num_cycles_active] + [
+        get_statistic_group_counts(name, name_key, counts, desc) for name, name_key, counts, desc in [
+            ('num_reads_device', 'device', memory._num_reads_device, 'The reads accepted from the device'),
+            ('num_writes_device', 'device', memory._num_writes_device, 'The writes accepted from the device'),
+            ('num_reads_channel', 'channel', memory._num_reads_channel, 'The reads accepted for the channel')]]
+    return group
+
+
+def get_statistic_group_counts(name, name_key, counts, desc):
+    # a counter by key, the device of a text trace ('') being device 0 as in a binary trace
+    group = StatisticGroup().set_name(name)
+    for key in sorted(counts, key=lambda key: 0 if key == '' else int(key)):
+        group.add_scalar('{}{}'.format(name_key, 0 if key == '' else key), counts[key], desc)
+    return group
+
+
+def export_statistics(group, args):
+    # write the statistics tree as JSON and as a CSV table of (statistic, value, description)
+    if args.stats_json != '':
+        with open(args.stats_json, 'w') as f:
+            json.dump({group.get_name(): group.to_dict(list_percentiles)}, f, indent=4)
+    if args.stats_csv != '':
+        with open(args.stats_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['statistic', 'value', 'description'])
+            for row in group.to_rows(list_percentiles):
+                writer.writerow(row)
+
+
+def print_percentiles_channels(list_channel_histograms):
+    # the latency percentiles of every channel, given as (channel, histograms by name)
+    for channel, histograms in list_channel_histograms:
+        for name in list_histograms_channel:
+            for name_stat, value in get_percentiles(histograms[name]).items():
+                print('#{} channel {}: {}'.format(name_stat, channel, value))
+
+
 def print_statistics(memory, args):
     # MAH.print_internal_state()
-    print('#cycle: {}'.format(memory.get_num_cycle()))
+    for name, value in get_statistics(memory).items():
+        print('#{}: {}'.format(name, value))
+    if args.display == 'more':
+        print_percentiles_channels([(ctrl.channel.id_, {name: getattr(ctrl, name) for name in list_histograms_channel})
+                                    for ctrl in memory.ctrls])
+    export_statistics(get_statistic_group(memory), args)
+
+
+def get_statistics_channel(memory):
+    # the statistics of a memory that simulates a single channel, as plain
+    # values that can be sent back from a worker process
+    assert len(memory.ctrls) == 1
+    ctrl = memory.ctrls[0]
+    stats = {name: getattr(ctrl, name) for name in list_counters_channel + list_histograms_channel}
+    stats['channel'] = ctrl.channel.id_
+    stats['num_cycles'] = memory.get_num_cycle()
+    stats['tCK'] = memory.spec.speed_entry.tCK
+    stats['max_bandwidth'] = memory._max_bandwidth.scalar
+    stats['group'] = ctrl.get_statistic_group()
+    stats['energy'] = ctrl.power.get_energy()
+    stats['energy_calibrated'] = ctrl.power.calibrated
+    return stats
+
+
+def print_statistics_channels(list_stats, args):
+    # the memory is done when its last channel is
+    print('#cycle: {}'.format(max(stats['num_cycles'] for stats in list_stats)))
+    for stats in list_stats:
+        print('#cycle channel {}: {}'.format(stats['channel'], stats['num_cycles']))
+    for name in list_counters_channel:
+        print('#{}: {}'.format(name.lstrip('_'), sum(stats[name] for stats in list_stats)))
+    for name in list_histograms_channel:
+        for name_stat, value in get_percentiles(merge_histograms([stats[name] for stats in list_stats])).items():
+            print('#{}: {}'.format(name_stat, value))
+    energy = sum(stats['energy'] for stats in list_stats)
+    print('#energy: {}'.format(energy))
+    print('#energy_per_bit: {}'.format(get_energy_per_bit(
+        energy, sum(stats['_bytes_read'] + stats['_bytes_write'] for stats in list_stats))))
+    print('#energy_calibrated: {}'.format(all(stats['energy_calibrated'] for stats in list_stats)))
+    if args.display == 'more':
+        print_percentiles_channels([(stats['channel'], stats) for stats in list_stats])
+    export_statistics(get_statistic_group_memory(max(stats['num_cycles'] for stats in list_stats),
+                                                 list_stats[0]['tCK'], list_stats[0]['max_bandwidth'],
+                                                 [stats['group'] for stats in list_stats]), args)
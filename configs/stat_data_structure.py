@@ -29,3 +29,131 @@ class VectorStatistic(BaseStatistic):
     def __init__(self):
         super(VectorStatistic, self).__init__()
         self.vector = []
+
+
+class HistogramStatistic(BaseStatistic):
+    # A histogram of non-negative integers in log-scaled buckets (as in HDR
+    # histograms): the values below 2 ** (sub_bits + 1) have a bucket each, and
+    # every further power of two is split into 2 ** sub_bits buckets. A value is
+    # thus known within a relative error of 2 ** -sub_bits, and the number of
+    # buckets only grows with the logarithm of the largest value.
+    def __init__(self, sub_bits=7):
+        super(HistogramStatistic, self).__init__()
+        self.sub_bits = sub_bits
+        self.counts = []  # type: list
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+    
+    def _get_index(self, value):
+        shift = value.bit_length() - self.sub_bits - 1
+        if shift <= 0:
+            return value
+        return (shift << self.sub_bits) + (value >> shift)
+    
+    def _get_highest(self, index):
+        # the largest value in the bucket index
+        shift = (index >> self.sub_bits) - 1
+        if shift <= 0:
+            return index
+        return ((index - (shift << self.sub_bits) + 1) << shift) - 1
+    
+    def add(self, value, num=1):
+        assert value >= 0
+        index = self._get_index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += num
+        self.count += num
+        self.sum += value * num
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+    
+    def merge(self, other):
+        assert other.sub_bits == self.sub_bits
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        return self
+    
+    def get_mean(self):
+        return 0 if self.count == 0 else self.sum / self.count
+    
+    def get_percentile(self, percentile):
+        # the smallest value (within the bucket error) that percentile percent
+        # of the values do not exceed, 0 if the histogram is empty
+        if self.count == 0:
+            return 0
+        rank = max(1, -(-self.count * percentile // 100))
+        total = 0
+        for index, count in enumerate(self.counts):
+            total += count
+            if total >= rank:
+                return min(self._get_highest(index), self.max)
+        return self.max
+
+
+class StatisticGroup(BaseStatistic):
+    # A node of the statistics tree (e.g., the memory, a channel or a bank):
+    # its statistics and subgroups in the order they were added.
+    def __init__(self):
+        super(StatisticGroup, self).__init__()
+        self.statistics = []  # type: list
+    
+    def add(self, statistic: BaseStatistic):
+        self.statistics.append(statistic)
+        return self
+    
+    def add_scalar(self, name, value, desc=''):
+        return self.add(ScalarStatistic(value).set_name(name).set_desc(desc))
+    
+    def get(self, name):
+        for statistic in self.statistics:
+            if statistic.get_name() == name:
+                return statistic
+        raise KeyError(name)
+    
+    def to_dict(self, percentiles):
+        # nested by group, a histogram as its count, mean, percentiles and maximum
+        return {statistic.get_name(): self._to_value(statistic, percentiles) for statistic in self.statistics}
+    
+    def to_rows(self, percentiles, path=''):
+        # (dotted path, value, description) of every statistic in the tree
+        path = path + self.get_name()
+        for statistic in self.statistics:
+            if isinstance(statistic, StatisticGroup):
+                for row in statistic.to_rows(percentiles, path + '.'):
+                    yield row
+            elif isinstance(statistic, HistogramStatistic):
+                for name, value in self._to_value(statistic, percentiles).items():
+                    yield '{}.{}.{}'.format(path, statistic.get_name(), name), value, statistic.get_desc()
+            else:
+                yield '{}.{}'.format(path, statistic.get_name()), self._to_value(statistic, percentiles), \
+                      statistic.get_desc()
+    
+    @staticmethod
+    def _to_value(statistic, percentiles):
+        if isinstance(statistic, StatisticGroup):
+            return statistic.to_dict(percentiles)
+        elif isinstance(statistic, HistogramStatistic):
+            value = {'count': statistic.count, 'mean': statistic.get_mean()}
+            for percentile in percentiles:
+                value['p{:g}'.format(percentile)] = statistic.get_percentile(percentile)
+            value['max'] = 0 if statistic.max is None else statistic.max
+            return value
+        elif isinstance(statistic, ScalarStatistic):
+            return statistic.scalar
+        elif isinstance(statistic, VectorStatistic):
+            return list(statistic.vector)
+        else:
+            raise Exception(statistic)
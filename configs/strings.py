@@ -39,3 +39,9 @@ list_translation = [translation_random, translation_none]
 memory_type_ChRaBaRoCo = 'ChRaBaRoCo'
 memory_type_RoBaRaCoCh = 'RoBaRaCoCh'
 list_memory_type = [memory_type_ChRaBaRoCo, memory_type_RoBaRaCoCh]
+
+queue_read_depth = 'queue_read_depth'
+queue_write_depth = 'queue_write_depth'
+queue_activate_depth = 'queue_activate_depth'
+queue_other_depth = 'queue_other_depth'
+list_queue_depth = [queue_read_depth, queue_write_depth, queue_activate_depth, queue_other_depth]
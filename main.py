@@ -3,14 +3,35 @@ import os
 from tap import Tap
 from configs import strings, sim_help
 
+dirname_root = os.path.dirname(os.path.abspath(__file__))
+
 
 class ArgumentParser(Tap):
     name_spec: str = strings.standard.hbm
     org: str = ''
     speed: str = ''
     mapping: str = 'defaultmapping'
+    trace: str = 'dram.trace'  # plain, gzip or xz compressed text, or binary
+    # the arrival cycles of a text trace are CPU cycles, converted with cpu_tick and mem_tick of the config file
+    convert_trace: str = ''  # convert the text trace to a binary trace with this name and exit
     display: str = 'more'  # more, less
     ideal: int = 0  # ideal experiment
+    skip_idle: bool = False  # event-driven mode: jump over the cycles in which nothing can happen
+    # Simulate the channels in this many processes, each on the part of the
+    # trace that maps to it. The result is that of the serial run, unless a
+    # full queue stalls the serial run: the channels no longer stall each other.
+    num_processes: int = 1
+    stats_json: str = ''  # write every statistic, by channel, rank and bank, to this JSON file
+    stats_csv: str = ''  # write every statistic to this CSV file
+    sample_interval: int = 0  # write the statistics of every window of this many cycles, 0 for none
+    sample_output: str = 'samples.jsonl'  # the JSON lines file of the windows
+    profile: bool = False  # report the wall-clock time spent in every phase of the simulator
+    # record the commands of every channel to <cmd_trace_prefix>-channel<id>.bin, also set
+    # by record_cmd_trace in the config file, and print them (print_cmd_trace)
+    record_cmd_trace: bool = False
+    print_cmd_trace: bool = False
+    cmd_trace_prefix: str = 'cmd-trace'
+    replay_cmd_trace: str = ''  # replay this command trace of a channel on the DRAM and exit
     
     num_ranks = -1
     num_channels = -1
@@ -21,10 +42,27 @@ class ArgumentParser(Tap):
     expected_limit_insts = 0
     translation = strings.translation_none
     print = False
+    
+    # controller queue depths, -1 takes the config file value or else 32
+    queue_read_depth: int = -1
+    queue_write_depth: int = -1
+    queue_activate_depth: int = -1
+    queue_other_depth: int = -1
+    
+    # controller policies
+    scheduler: str = 'FRFCFS_CAP'  # FCFS, FRFCFS, FRFCFS_CAP, FRFCFS_PriorHit
+    cap: int = 16  # the hits to an opened row after which FRFCFS_CAP stops prioritizing it
+    row_policy: str = 'opened'  # closed, closedAP, opened, timeout
+    timeout: int = 50  # the idle cycles after which the timeout row policy closes a row
+    powerdown_timeout: int = 0  # the idle cycles after which a rank enters power-down, 0 never
+    selfrefresh_timeout: int = 0  # the idle cycles after which a rank enters self-refresh, 0 never
+    refresh_mode: str = 'rank'  # rank (REF of all banks every nREFI), bank (REFSB of every bank every nREFI, in turn)
+    wr_high_watermark: float = 0.8  # the write queue occupancy that starts the write mode
+    wr_low_watermark: float = 0.2  # the write queue occupancy that ends the write mode
 
 
 def parse_config(args_):
-    filename = 'offchip/configs/{}-config.txt'.format(args_.name_spec.value.upper())
+    filename = os.path.join(dirname_root, 'offchip', 'configs', '{}-config.txt'.format(args_.name_spec.value.upper()))
     if not os.path.exists(filename):
         raise Exception('Bad config file')
     with open(filename, 'r') as f:
@@ -56,75 +94,271 @@ def parse_config(args_):
         elif items[0] == 'warmup_insts':
             args_.warmup_insts = int(items[1])
         elif items[0] == 'org':
-            args_.org = items[1].split('_')[1]
+            if args_.org == '':
+                args_.org = items[1].split('_')[1]
         elif items[0] == 'speed':
-            args_.speed = items[1].split('_')[1]
+            if args_.speed == '':
+                args_.speed = items[1].split('_')[1]
         elif items[0] == 'translation':
             args_.translation = items[1].lower()
             assert args_.translation in strings.list_translation
+        elif items[0] in ['record_cmd_trace', 'print_cmd_trace']:
+            # either the command line or the config file turns them on
+            assert items[1] in ['on', 'off']
+            if items[1] == 'on':
+                setattr(args_, items[0], True)
+        elif items[0] in strings.list_queue_depth:
+            # the command line has precedence over the config file
+            if getattr(args_, items[0]) == -1:
+                setattr(args_, items[0], int(items[1]))
+    
+    for name in strings.list_queue_depth:
+        if getattr(args_, name) == -1:
+            setattr(args_, name, 32)
+        assert getattr(args_, name) > 0
     
     return args_
 
 
-class Global(object):
-    args = parse_config(
-        ArgumentParser(description='simulation - DRAM').parse_args()
-    )  # type: ArgumentParser
+def get_args(argv=None):
+    # the arguments of a simulation from argv (the command line if None) and the config file
+    return parse_config(ArgumentParser(description='simulation - DRAM').parse_args(argv))
 
 
-from offchip.data_structure import Request, Trace
+from offchip.standard import get_spec
+from offchip.simulator import Simulator
+from offchip.data_structure import Request, Trace, BinaryTrace, CommandTrace
 
 
-def main(args_, spec_, trace_: Trace):
-    from offchip.standard.spec_base import BaseSpec
-    from offchip.controller import Controller
-    from offchip.dram_module import DRAM
-    spec_: BaseSpec
-    ctrls = []
-    for i in range(args_.num_channels):
-        channel = DRAM(spec_, args_, BaseSpec.level.channel, i)
-        ctrl = Controller(spec_, channel)
-        ctrls.append(ctrl)
-    from offchip.memory import Memory
-    memory = Memory(args_, ctrls)
+def simulate(args_, spec_, trace_: Trace, channels=None, cycle_drain=0, profiler=None, finish=True):
+    # simulate the channels (all of them by default) and return the memory;
+    # the write queues are drained once the trace ends, but not before cycle_drain
+    memory = Simulator(args_, spec_, channels).memory
+    if profiler is not None:
+        profiler.instrument_memory(memory)
+        profiler.instrument(trace_, 'get_trace_request', 'trace')
+    trace_.set_decoder(memory.mapping.decode_batch)
+    
+    interval_print = 10000
+    cycle_end = 1000000
+    sampler = None
+    if args_.sample_interval > 0:
+        sampler = sim_help.IntervalSampler(memory, args_.sample_interval, args_.sample_output)
+        if profiler is not None:
+            profiler.instrument(sampler, 'sample', 'statistics')
     
     flag_end = False
     request = None  # type: Request
     while flag_end is False or memory.get_num_pending_requests() > 0:
-        if flag_end is False and memory.flag_stall is False:
+        if flag_end is False and request is None:
             flag_end, request = trace_.get_trace_request()
         
-        if flag_end is False:
+        # a request is sent from the cycle given by the trace on, and again in
+        # every cycle until the memory accepts it
+        if request is not None and request.cycle_inject <= memory.get_num_cycle():
             memory.send(request)
+            if memory.flag_stall is False:
+                request = None
         
-        if flag_end is True:
+        if flag_end is True and memory.get_num_cycle() >= cycle_drain:
             # make sure that all write requests in the write queue are drained
             memory.set_high_writeq_watermark(0.0)
         
-        sim_help.print_state_periodically(memory, start=0, interval=10000, do_print_state=False)
+        if args_.skip_idle is True and (flag_end is True or request is not None):
+            # no request can be injected before the memory changes its state,
+            # so jump to the cycle right before the next event
+            cycle_next = min(memory.get_next_event_cycle() - 1,
+                             sim_help.get_next_checkpoint(memory, interval=interval_print, end=cycle_end))
+            if request is not None and request.cycle_inject > memory.get_num_cycle():
+                cycle_next = min(cycle_next, request.cycle_inject - 1)
+            if flag_end is True and memory.get_num_cycle() < cycle_drain:
+                cycle_next = min(cycle_next, cycle_drain - 1)
+            if sampler is not None:
+                # the cycle that ends the window is simulated
+                cycle_next = min(cycle_next, sampler.cycle_next - 1)
+            memory.skip_to(cycle_next)
+        
+        sim_help.print_state_periodically(memory, start=0, interval=interval_print, do_print_state=False)
         # sim_help.print_state_periodically(start=0, interval=100, do_print_state=True)
-        sim_help.early_termination(memory, end=1000000, args=args_)
+        sim_help.early_termination(memory, end=cycle_end, args=args_, sampler=sampler)
         
         memory.cycle()
+        if sampler is not None and memory.get_num_cycle() == sampler.cycle_next:
+            sampler.sample(memory)
     
-    memory.finish()
+    if sampler is not None:
+        sampler.close(memory)
+    if finish is True:
+        memory.finish()
+    return memory
+
+
+def simulate_idle(args_, memory, cycle_end, cycle_drain=0):
+    # carry a memory without pending requests on to cycle_end, as the serial
+    # simulation does with the channels that are done before the others
+    while memory.get_num_cycle() < cycle_end:
+        if memory.get_num_cycle() >= cycle_drain:
+            memory.set_high_writeq_watermark(0.0)
+        if args_.skip_idle is True:
+            cycle_next = min(memory.get_next_event_cycle() - 1, cycle_end - 1)
+            if memory.get_num_cycle() < cycle_drain:
+                cycle_next = min(cycle_next, cycle_drain - 1)
+            memory.skip_to(cycle_next)
+        memory.cycle()
+
+
+def main(args_, spec_, trace_: Trace):
+    profiler = None
+    if args_.profile is True:
+        from configs.profiler import Profiler
+        profiler = Profiler()
+    memory = simulate(args_, spec_, trace_, profiler=profiler)
+    if profiler is not None:
+        profiler.stop()
     sim_help.print_statistics(memory, args_)
+    if profiler is not None:
+        profiler.print_report(memory.get_num_cycle())
+
+
+def replay(args_, spec_, cmd_trace_filename):
+    # Issue the recorded commands of a channel to a new channel without any
+    # scheduling, and return the channel, the cycle of the last command, the
+    # number of commands of every kind, the power of the channel up to its last
+    # command and the commands that were not legal in the state of the channel
+    # or violated its timing.
+    from offchip.dram_module import DRAM
+    from offchip.power import Power
+    channel_id, records = CommandTrace.read(cmd_trace_filename)
+    channel = DRAM(spec_, args_, spec_.level.channel, channel_id)
+    power = Power(channel)
+    num_cmds = {cmd.name: 0 for cmd in spec_.cmd if cmd != spec_.cmd.MAX}
+    violations = []
+    cycle = 0
+    for cycle, cmd_value, addr_list in records:
+        cmd = spec_.cmd(cmd_value)
+        if channel.decode(cmd, addr_list) != cmd or not channel.check(cmd, addr_list, cycle):
+            violations.append((cycle, cmd.name, addr_list))
+        channel.update(cmd, addr_list, cycle)
+        power.update(cmd, addr_list, cycle)
+        num_cmds[cmd.name] += 1
+    power.finish(cycle)
+    return channel, cycle, num_cmds, power, violations
+
+
+def main_replay(args_, spec_, cmd_trace_filename):
+    channel, num_cycles, num_cmds, power, violations = replay(args_, spec_, cmd_trace_filename)
+    print('#channel: {}'.format(channel.id_))
+    print('#cycle: {}'.format(num_cycles))
+    for name, num in num_cmds.items():
+        print('#cmd_{}: {}'.format(name, num))
+    # the data bus carries a burst for every read and write
+    num_bursts = sum(num_cmds[cmd.name] for cmd in spec_.cmd if spec_.is_accessing(cmd))
+    print('#data_bus_utilization: {}'.format(0 if num_cycles == 0 else
+                                              num_bursts * spec_.speed_entry.nBL / num_cycles))
+    print('#energy: {}'.format(power.get_energy()))
+    print('#energy_per_bit: {}'.format(sim_help.get_energy_per_bit(
+        power.get_energy(), num_bursts * spec_.prefetch_size * spec_.channel_width / 8)))
+    print('#energy_calibrated: {}'.format(power.calibrated))
+    print('#violations: {}'.format(len(violations)))
+    for cycle, name, addr_list in violations[:10]:
+        print('  {} {} {}'.format(cycle, name, addr_list))
+
+
+def simulate_channels(args_, channels, trace_filenames, cycle_drain, conn):
+    # runs in a worker process of main_parallel, whose progress would only
+    # interleave with that of the other workers: simulates its channels, sends
+    # their last cycles, and carries them on to the last cycle of the memory it
+    # receives, so that they refresh and stay in their power states until then
+    # as in the serial run, before it sends their statistics
+    import contextlib
+    try:
+        with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+            memories = [simulate(args_, get_spec(args_), BinaryTrace(trace_filename), [channel], cycle_drain,
+                                 finish=False)
+                        for channel, trace_filename in zip(channels, trace_filenames)]
+            list_num_cycles = [memory.get_num_cycle() for memory in memories]
+            conn.send(list_num_cycles)
+            num_cycles = conn.recv()
+            list_stats = []
+            for memory, num_cycles_channel in zip(memories, list_num_cycles):
+                simulate_idle(args_, memory, num_cycles, cycle_drain)
+                memory.finish()
+                stats = sim_help.get_statistics_channel(memory)
+                stats['num_cycles'] = num_cycles_channel  # the cycle the channel was done
+                list_stats.append(stats)
+        conn.send(list_stats)
+    except SystemExit as e:
+        # a worker that exits would leave main_parallel waiting for it forever
+        conn.send(Exception('channels {} exited with {}'.format(channels, e.code)))
+    except Exception as e:
+        conn.send(e)
+
+
+def receive(conn):
+    # the message of a worker process, whose exception is raised
+    message = conn.recv()
+    if isinstance(message, Exception):
+        raise message
+    return message
+
+
+def main_parallel(args_, spec_, trace_: Trace):
+    if args_.sample_interval > 0:
+        # the workers would write their windows to the same file
+        raise Exception('The interval sampling needs a serial simulation.')
+    if args_.profile is True:
+        raise Exception('The profiling needs a serial simulation.')
+    import tempfile
+    import multiprocessing
+    from offchip.memory import Memory, AddressMapping
+    mapping = AddressMapping(spec_, Memory.type_)
+    with tempfile.TemporaryDirectory() as dirname:
+        filenames = [os.path.join(dirname, 'channel{}.trace'.format(i)) for i in range(args_.num_channels)]
+        # without stalls, the serial simulation sends a request per cycle (none
+        # before its arrival) and drains the write queues from the cycle after the last request
+        cycle_drain = BinaryTrace.partition(trace_, mapping.decode_batch, spec_.level.channel.value, filenames)
+        
+        # every worker builds its own spec, whose tables hold functions that
+        # cannot be pickled, and keeps its memories until the last channel is done
+        num_processes = min(args_.num_processes, args_.num_channels)
+        conns = []
+        for i in range(num_processes):
+            conn, conn_worker = multiprocessing.Pipe()
+            channels = list(range(i, args_.num_channels, num_processes))
+            multiprocessing.Process(target=simulate_channels, daemon=True,
+                                    args=(args_, channels, [filenames[channel] for channel in channels],
+                                          cycle_drain, conn_worker)).start()
+            conn_worker.close()
+            conns.append(conn)
+        num_cycles = max(max(receive(conn)) for conn in conns)
+        for conn in conns:
+            conn.send(num_cycles)
+        list_stats = sorted([stats for conn in conns for stats in receive(conn)], key=lambda stats: stats['channel'])
+    sim_help.print_statistics_channels(list_stats, args_)
 
 
 if __name__ == '__main__':
-    print(Global.args)
+    args = get_args()
+    print(args)
     print()
     
     # DRAM trace
-    trace_file = 'dram.trace'
+    trace_file = args.trace
     
-    name_spec = Global.args.name_spec
-    if name_spec == strings.standard.hbm:
-        from offchip.standard.spec_base import BaseSpec
-        Standard = BaseSpec
-    else:
-        raise Exception(name_spec)
+    if args.convert_trace != '':
+        BinaryTrace.convert(trace_file, args.convert_trace, args.cpu_tick, args.mem_tick)
+        exit(0)
     
-    standard = Standard.initialize()
-    trace = Trace(trace_file)
-    main(Global.args, Standard, trace)
+    standard = get_spec(args)
+    if args.replay_cmd_trace != '':
+        main_replay(args, standard, args.replay_cmd_trace)
+        exit(0)
+    
+    if BinaryTrace.is_binary(trace_file):
+        trace = BinaryTrace(trace_file)
+    else:
+        trace = Trace(trace_file, cpu_tick=args.cpu_tick, mem_tick=args.mem_tick)
+    if args.num_processes > 1:
+        main_parallel(args, standard, trace)
+    else:
+        main(args, standard, trace)
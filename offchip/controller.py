@@ -1,13 +1,15 @@
+from configs.stat_data_structure import HistogramStatistic, StatisticGroup
 from offchip.data_structure import Request
 
 
 class Controller(object):
     from offchip.dram_module import DRAM
-    from offchip.data_structure import Queue
+    from offchip.data_structure import Queue, RequestQueue, CommandTrace
     
     def __init__(self, t_spec, channel: DRAM):
-        from offchip.schedule import Scheduler, RowTable, RowPolicy
+        from offchip.schedule import Scheduler, RowTable, RowPolicy, PowerPolicy
         from offchip.refresh import Refresh
+        from offchip.power import Power
         from offchip.standard.spec_base import BaseSpec
         self.t_spec = t_spec  # type:BaseSpec
         self.cycle_curr = 0
@@ -16,22 +18,41 @@ class Controller(object):
         self.scheduler = Scheduler(self)
         self.row_policy = RowPolicy(self)
         self.row_table = RowTable(self)
+        self.power_policy = PowerPolicy(self)
         self.refresh = Refresh(self)
+        self.power = Power(self.channel)
         
-        self.queue_read = Controller.Queue()
-        self.queue_write = Controller.Queue()
-        self.queue_activate = Controller.Queue()
+        args = channel.args
+        len_bank = self.t_spec.level.bank.value + 1
+        len_row = self.t_spec.level.row.value + 1
+        self.queue_read = Controller.RequestQueue(len_bank, len_row, args.queue_read_depth)
+        self.queue_write = Controller.RequestQueue(len_bank, len_row, args.queue_write_depth)
+        self.queue_activate = Controller.RequestQueue(len_bank, len_row, args.queue_activate_depth)
         # read and write requests for which activate was issued are moved to
         # actq, which has higher priority than readq and writeq.
         # This is an optimization for avoiding useless activations (i.e., PRECHARGE
         # after ACTIVATE w/o READ of WRITE command)
-        self.queue_other = Controller.Queue()  # queue for all "other" requests (e.g., refresh)
+        self.queue_other = Controller.RequestQueue(len_bank, len_row, args.queue_other_depth)  # queue for all "other" requests (e.g., refresh)
         
         self.pending_reads = Controller.Queue()  # read requests that are about to receive data from DRAM
+        self.completed = None  # the completed requests are appended to this list, if set
         self.write_mode = False
+        self.num_cmds_issued = 0
+        # the first command of each queued request, grouped by bank: only the
+        # commands to a bank can change the decode of its requests, commands of
+        # a wider scope (e.g., REF, PREA) invalidate every bank
+        self._len_bank = len_bank
+        self._first_cmd = {}  # type: dict
         
-        self.wr_high_watermark = 0.8
-        self.wr_low_watermark = 0.2
+        # the commands issued are recorded to a file and/or printed
+        self.cmd_trace = None  # type: Controller.CommandTrace
+        if args.record_cmd_trace is True:
+            self.cmd_trace = Controller.CommandTrace('{}-channel{}.bin'.format(args.cmd_trace_prefix, channel.id_),
+                                                     channel.id_, len(t_spec.level))
+        self.print_cmd_trace = args.print_cmd_trace
+        
+        self.wr_high_watermark = args.wr_high_watermark
+        self.wr_low_watermark = args.wr_low_watermark
         
         # statistics
         self._bytes_read = 0
@@ -50,6 +71,13 @@ class Controller(object):
         
         self._latency_read_sum = 0
         self._latency_read_avg = 0
+        # the latencies of all completed requests, the forwarded reads included
+        self._latency_read_histogram = HistogramStatistic() \
+            .set_name('latency_read') \
+            .set_desc('The cycles from the arrival of a read to its data')
+        self._latency_write_histogram = HistogramStatistic() \
+            .set_name('latency_write') \
+            .set_desc('The cycles from the arrival of a write to its command')
         
         self._req_queue_length_avg = 0
         self._req_queue_length_sum = 0
@@ -65,12 +93,55 @@ class Controller(object):
         self._record_misses_write = 0
         self._record_conflicts_write = 0
     
-    def finish(self, read_req):
-        self._latency_read_avg = 0 if read_req == 0 else self._latency_read_sum / read_req
+    def finish(self):
+        # over every completed read, the forwarded ones included, as the histogram
+        self._latency_read_avg = self._latency_read_histogram.get_mean()
         self._req_queue_length_avg = self._req_queue_length_sum / self.cycle_curr
         self._req_queue_length_read_avg = self._req_queue_length_read_sum / self.cycle_curr
         self._req_queue_length_write_avg = self._req_queue_length_write_sum / self.cycle_curr
         self.channel.finish(self.cycle_curr)
+        self.power.finish(self.cycle_curr)
+        if self.cmd_trace is not None:
+            self.cmd_trace.close()
+            self.cmd_trace = None
+    
+    def get_statistic_group(self):
+        # the statistics of the controller and of its channel, down to the banks
+        group = StatisticGroup().set_name('channel{}'.format(self.channel.id_))
+        group.add_scalar('num_cycles', self.cycle_curr, 'The number of cycles simulated')
+        group.add_scalar('num_cmds_issued', self.num_cmds_issued, 'The number of commands issued')
+        group.add_scalar('bytes_read', self._bytes_read, 'The bytes read')
+        group.add_scalar('bytes_write', self._bytes_write, 'The bytes written')
+        for kind, desc in [('hits', 'row hits'), ('misses', 'row misses'), ('conflicts', 'row conflicts')]:
+            group.add_scalar('{}_row'.format(kind), getattr(self, '_{}_row'.format(kind)),
+                             'The number of {}'.format(desc))
+            for type_ in ['read', 'write']:
+                group.add_scalar('{}_row_{}'.format(kind, type_), getattr(self, '_{}_row_{}'.format(kind, type_)),
+                                 'The number of {} of {} requests'.format(desc, type_))
+        group.add_scalar('useless_activates', self.useless_activates,
+                         'The number of rows precharged without a hit after their activation')
+        group.add_scalar('latency_read_sum', self._latency_read_sum, 'The total latency of the reads that accessed a row')
+        group.add_scalar('latency_read_avg', self._latency_read_avg, 'The average latency of a read')
+        group.add(self._latency_read_histogram)
+        group.add(self._latency_write_histogram)
+        group.add_scalar('req_queue_length_avg', self._req_queue_length_avg, 'The average length of the queues')
+        group.add_scalar('req_queue_length_read_avg', self._req_queue_length_read_avg,
+                         'The average length of the read queue')
+        group.add_scalar('req_queue_length_write_avg', self._req_queue_length_write_avg,
+                         'The average length of the write queue')
+        group.add_scalar('num_powerdowns', self.power_policy.num_powerdowns,
+                         'The number of power-down entries of the idle-timeout policy')
+        group.add_scalar('num_selfrefreshes', self.power_policy.num_selfrefreshes,
+                         'The number of self-refresh entries of the idle-timeout policy')
+        group.add_scalar('num_refreshes', self.refresh.num_refreshes,
+                         'The number of refreshes (REF of a rank or REFSB of a bank)')
+        group.add_scalar('num_refreshes_postponed', self.refresh.num_refreshes_postponed,
+                         'The refresh intervals of a bank that ended with its refresh postponed')
+        group.add_scalar('num_refreshes_pulled_in', self.refresh.num_refreshes_pulled_in,
+                         'The refreshes of a bank pulled in ahead of their interval')
+        group.add(self.power.get_statistic_group())
+        self.channel.add_statistics(group)
+        return group
     
     def _get_queue(self, type_):
         if type_ == Request.Type.read:
@@ -90,19 +161,18 @@ class Controller(object):
             raise Exception(queue.size())
         
         req.cycle_arrive = self.cycle_curr
-        queue.push_i(req)
+        if req.type == Request.Type.read and self.queue_write.count_addr(req.addr_int) > 0:
+            # forward the data of a queued write to the same address
+            req.cycle_depart = self.cycle_curr + 1
+            self.pending_reads.push_i(req)
+            return True
         
-        if req.type == Request.Type.read:
-            for wreq in self.queue_write.queue_req:
-                if wreq.addr_int == req.addr_int:
-                    req.cycle_depart = self.cycle_curr + 1
-                    self.pending_reads.queue_req.append(req)
-                    self.queue_read.queue_req.pop(-1)
-                    break
+        queue.push_i(req)
         return True
     
     def cycle(self):
         self.cycle_curr += 1
+        self._update_queue_length_sums(1)
         
         # 1. Serve completed reads
         if self.pending_reads.size() > 0:
@@ -111,21 +181,17 @@ class Controller(object):
                 if req.cycle_depart - req.cycle_arrive > 1:  # this request really accessed a row
                     self._latency_read_sum += req.cycle_depart - req.cycle_arrive
                     self.channel.update_serving_requests(req.addr_list, -1, self.cycle_curr)
+                self._latency_read_histogram.add(req.cycle_depart - req.cycle_arrive)
                 req.callback(req)
+                if self.completed is not None:
+                    self.completed.append(req)
                 self.pending_reads.pop_i(0)
         
         # 2. Refresh scheduler
         self.refresh.cycle()
         
         # 3. Should we schedule writes?
-        if self.write_mode is False:
-            # write queue is almost full or read queue is empty
-            if self.queue_write.size() > int(self.wr_high_watermark * self.queue_write.max) or self.queue_read.size() == 0:
-                self.write_mode = True
-        else:
-            # write queue is almost empty and read queue is not empty
-            if self.queue_write.size() < int(self.wr_low_watermark * self.queue_write.max) and self.queue_read.size() != 0:
-                self.write_mode = False
+        self.write_mode = self._get_write_mode()
         
         # 4. Find the best command to schedule, if any
         
@@ -140,14 +206,7 @@ class Controller(object):
             is_valid_req = self.is_ready_cmd(cmd, req.addr_list)
         
         if is_valid_req is False:
-            # "other" requests are rare, so we give them precedence over reads/writes
-            if self.queue_other.size() > 0:
-                queue = self.queue_other
-            elif self.write_mode is True:
-                queue = self.queue_write
-            else:
-                queue = self.queue_read
-            
+            queue = self._get_schedule_queue()
             req = self.scheduler.get_head(queue.queue_req)
             is_valid_req = (req is not None)
             if is_valid_req is True:
@@ -161,6 +220,11 @@ class Controller(object):
             victim = self.row_policy.get_victim(cmd)
             if len(victim) > 0:
                 self._issue_cmd(cmd, victim)
+                return
+            # or to power down an idle rank
+            cmd_power = self.power_policy.get_cmd()
+            if cmd_power is not None:
+                self._issue_cmd(*cmd_power)
             return
         
         if req.is_first_command is True:
@@ -200,8 +264,9 @@ class Controller(object):
         if cmd != self.channel.t_spec.translate[req.type]:
             if self.channel.t_spec.is_opening(cmd):
                 # promote the request that caused issuing activation to actq
+                # (or to its back, if its row was closed again before the access)
+                queue.remove(req)
                 self.queue_activate.push_i(req)
-                queue.queue_req.remove(req)
             return
         
         # set a future completion time for read requests
@@ -210,10 +275,51 @@ class Controller(object):
             self.pending_reads.push_i(req)
         
         if req.type == Request.Type.write:
+            # a write completes as soon as its command is issued
+            req.cycle_depart = self.cycle_curr
             self.channel.update_serving_requests(req.addr_list, -1, self.cycle_curr)
+            self._latency_write_histogram.add(req.cycle_depart - req.cycle_arrive)
             req.callback(req)
+            if self.completed is not None:
+                self.completed.append(req)
+        
+        queue.remove(req)
+    
+    def get_next_event_cycle(self):
+        # The earliest cycle at which cycle() may change any state. Every cycle
+        # before it is idle and can be skipped with skip_cycles().
+        cycle_next = self.refresh.get_next_event_cycle()
+        
+        if self.pending_reads.size() > 0:
+            cycle_next = min(cycle_next, self.pending_reads.get_i(0).cycle_depart)
+        
+        if self._get_write_mode() != self.write_mode:
+            return self.cycle_curr + 1
+        
+        # a request can only be served once the timing of its first command is met
+        for queue in [self.queue_activate, self._get_schedule_queue()]:
+            for req in queue.queue_req:
+                cmd = self._get_first_cmd(req)
+                cycle_next = min(cycle_next, self.channel.get_next_ready_cycle(cmd, req.addr_list))
+        
+        # an opened row may be precharged speculatively
+        from offchip.standard.spec_base import BaseSpec as t_spec
+        cycle_victim = self.row_policy.get_next_event_cycle(t_spec.cmd.pre)
+        if cycle_victim is not None:
+            cycle_next = min(cycle_next, cycle_victim)
+        
+        # an idle rank may be powered down
+        cycle_power = self.power_policy.get_next_event_cycle()
+        if cycle_power is not None:
+            cycle_next = min(cycle_next, cycle_power)
         
-        queue.queue_req.remove(req)
+        return max(cycle_next, self.cycle_curr + 1)
+    
+    def skip_cycles(self, num_cycles):
+        self.cycle_curr += num_cycles
+        # the queues do not change while idle
+        self._update_queue_length_sums(num_cycles)
+        self.refresh.skip_cycles(num_cycles)
     
     def is_ready_req(self, request: Request):
         cmd = self._get_first_cmd(request)
@@ -253,34 +359,70 @@ class Controller(object):
     
     ###
     
+    def _update_queue_length_sums(self, num_cycles):
+        length_read = self.queue_read.size() + self.pending_reads.size()
+        length_write = self.queue_write.size()
+        self._req_queue_length_sum += (length_read + length_write) * num_cycles
+        self._req_queue_length_read_sum += length_read * num_cycles
+        self._req_queue_length_write_sum += length_write * num_cycles
+    
+    def _get_write_mode(self):
+        if self.write_mode is False:
+            # write queue is almost full or read queue is empty
+            if self.queue_write.size() > int(self.wr_high_watermark * self.queue_write.max) or self.queue_read.size() == 0:
+                return True
+        else:
+            # write queue is almost empty and read queue is not empty (a shallow
+            # queue must still leave the write mode, or the reads would starve)
+            if self.queue_write.size() < max(int(self.wr_low_watermark * self.queue_write.max), 1) and \
+                    self.queue_read.size() != 0:
+                return False
+        return self.write_mode
+    
+    def _get_schedule_queue(self):
+        # "other" requests are rare, so we give them precedence over reads/writes
+        if self.queue_other.size() > 0:
+            return self.queue_other
+        elif self.write_mode is True:
+            return self.queue_write
+        else:
+            return self.queue_read
+    
     def _get_first_cmd(self, request: Request):
-        cmd = self.channel.t_spec.translate[request.type]
-        return self.channel.decode(cmd, request.addr_list)
+        bank = tuple(request.addr_list[:self._len_bank])
+        if bank[-1] < 0:
+            # a request above the bank level (e.g., REF) depends on all its banks
+            return self.channel.decode(self.channel.t_spec.translate[request.type], request.addr_list)
+        
+        by_req = self._first_cmd.get(bank)
+        if by_req is None:
+            by_req = self._first_cmd[bank] = {}
+        cmd = by_req.get(request)
+        if cmd is None:
+            cmd = by_req[request] = self.channel.decode(self.channel.t_spec.translate[request.type],
+                                                        request.addr_list)
+        return cmd
+    
+    def _invalidate_first_cmd(self, cmd, addr_list):
+        if self.t_spec.scope[cmd.value].value >= self.t_spec.level.bank.value:
+            self._first_cmd.pop(tuple(addr_list[:self._len_bank]), None)
+        else:
+            self._first_cmd.clear()
     
     def _cmd_issue_autoprecharge(self, cmd, addr_list):
         from offchip.schedule import RowPolicy
         if self.channel.t_spec.is_accessing(cmd) and \
                 self.row_policy.type == RowPolicy.Type.closedAP:
-            # check if it is the last request to the opened row
+            # check if it is the last request to the opened row: cmd accesses the
+            # opened row, so every queued request to the same row is a row hit
             queue = self.queue_write if self.write_mode else self.queue_read
             row_group = addr_list[:self.t_spec.level.row.value + 1]
             
-            num_row_hits = 0
-            
-            for req in queue.queue_req:
-                if self.is_row_hit_req(req):
-                    row_group_2 = req.addr_list[:self.t_spec.level.row.value + 1]
-                    if row_group == row_group_2:
-                        num_row_hits += 1
+            num_row_hits = len(queue.get_row(row_group))
             
             if num_row_hits == 0:
-                queue = self.queue_activate
-                for req in queue.queue_req:
-                    if self.is_row_hit_req(req):
-                        row_group_2 = req.addr_list[:self.t_spec.level.row.value + 1]
-                        raise Exception(row_group, row_group_2)
-                        if row_group == row_group_2:
-                            num_row_hits += 1
+                # the request was promoted to actq when its row was activated
+                num_row_hits = len(self.queue_activate.get_row(row_group))
             
             assert num_row_hits > 0  # The current request should be a hit,
             # so there should be at least one request that hits in the current open row
@@ -295,10 +437,17 @@ class Controller(object):
         return cmd
     
     def _issue_cmd(self, cmd, addr_list):
-        # print(cmd, end='')
         cmd = self._cmd_issue_autoprecharge(cmd, addr_list)
         assert self.is_ready_cmd(cmd, addr_list)
         self.channel.update(cmd, addr_list, self.cycle_curr)
+        self.power.update(cmd, addr_list, self.cycle_curr)
+        self.power_policy.update(cmd, addr_list, self.cycle_curr)
+        if self.cmd_trace is not None:
+            self.cmd_trace.write(self.cycle_curr, cmd.value, addr_list)
+        if self.print_cmd_trace is True:
+            print('{},{},{}'.format(self.cycle_curr, cmd.name, ','.join(str(addr) for addr in addr_list)))
+        self._invalidate_first_cmd(cmd, addr_list)
+        self.num_cmds_issued += 1
         
         if cmd == self.t_spec.cmd.pre:
             if self.row_table.get_hits(addr_list, True) == 0:
@@ -1,33 +1,258 @@
 import os
-from typing import List
+import gzip
+import lzma
+import mmap
+import shutil
+import struct
+import itertools
+from typing import List, Dict
 from enum import Enum, unique
 
 
 class Trace(object):
-    def __init__(self, trace_filename):
+    # magic numbers of the compressed trace formats that are read transparently
+    dict_magic2open = {b'\x1f\x8b': gzip.open,
+                       b'\xfd7zXZ\x00': lzma.open}
+    
+    # A line of a text trace is an address, R or W and, optionally, the arrival
+    # cycle of the request in CPU cycles, which is converted to memory cycles:
+    # the memory runs mem_tick cycles in every cpu_tick CPU cycles.
+    def __init__(self, trace_filename, chunk_size=1 << 20, cpu_tick=1, mem_tick=1):
         self.ptr_line_next = 0
-        self.list_trace = []
+        self.trace_filename = trace_filename
+        self.chunk_size = chunk_size
+        self.cpu_tick = cpu_tick
+        self.mem_tick = mem_tick
+        assert cpu_tick > 0 and mem_tick > 0
+        self.chunk_requests = 4096
+        self.decode_batch = None  # decodes a list of addresses into address lists
         if not os.path.exists(trace_filename):
             raise Exception('File {} does not exist.'.format(trace_filename))
-        with open(trace_filename, 'r') as f:
-            self.list_trace = f.readlines()
         self.dict_RW2string = {'R': Request.Type.read,
                                'W': Request.Type.write}
+        # the trace is parsed lazily, one chunk at a time
+        self._requests = self._read_requests()
     
     def get_trace_request(self):
-        end, request = True, None
-        if self.ptr_line_next >= len(self.list_trace):
-            return end, request
-        
-        end = False
-        line = self.list_trace[self.ptr_line_next].strip()
-        items = line.split(' ')
-        req_addr = int(items[0][2:], 16)
-        req_type = self.dict_RW2string[items[1]]
-        request = Request(req_addr, req_type)
+        request = next(self._requests, None)
+        if request is None:
+            return True, request
         
         self.ptr_line_next += 1
-        return end, request
+        return False, request
+    
+    def set_decoder(self, decode_batch):
+        # decode the addresses of every chunk of requests in one pass
+        self.decode_batch = decode_batch
+    
+    def _open(self):
+        with open(self.trace_filename, 'rb') as f:
+            magic = f.read(6)
+        for k, open_ in self.dict_magic2open.items():
+            if magic.startswith(k):
+                return open_(self.trace_filename, 'rt')
+        return open(self.trace_filename, 'r')
+    
+    def _read_lines(self):
+        with self._open() as f:
+            rest = ''
+            while True:
+                chunk = f.read(self.chunk_size)
+                if chunk == '':
+                    break
+                lines = (rest + chunk).split('\n')
+                # the last line may continue in the next chunk
+                rest = lines.pop()
+                for line in lines:
+                    yield line
+            if rest != '':
+                yield rest
+    
+    def _read_records(self):
+        # (address, type, device, arrival cycle), -1 if the arrival is not given
+        for line in self._read_lines():
+            items = line.split()
+            if len(items) == 0:
+                continue
+            req_addr = int(items[0][2:], 16)
+            req_type = self.dict_RW2string[items[1]]
+            if len(items) > 2:
+                yield req_addr, req_type, '', int(items[2]) * self.mem_tick // self.cpu_tick
+            else:
+                yield req_addr, req_type, '', -1
+    
+    def _read_requests(self):
+        records = self._read_records()
+        while True:
+            chunk = list(itertools.islice(records, self.chunk_requests))
+            if len(chunk) == 0:
+                return
+            if self.decode_batch is None:
+                for req_addr, req_type, device, cycle_arrive in chunk:
+                    request = Request(req_addr, req_type, device)
+                    request.cycle_inject = cycle_arrive
+                    yield request
+                continue
+            
+            list_addr_list = self.decode_batch([record[0] for record in chunk])
+            for (req_addr, req_type, device, cycle_arrive), addr_list in zip(chunk, list_addr_list):
+                request = Request(req_addr, req_type, device)
+                request.addr_list = addr_list
+                request.cycle_inject = cycle_arrive
+                yield request
+
+
+class BinaryTrace(Trace):
+    # An 8-byte magic number followed by fixed-width little-endian records:
+    # address, arrival cycle (-1 if not given), device id (0 if not given) and
+    # type (0: read, 1: write). The file is memory-mapped and the records are
+    # unpacked in place, without a string per request.
+    magic = b'DRAMTRC1'
+    record = struct.Struct('<QqHB5x')
+    dict_type2code = {'read': 0,  # keyed by the value of Request.Type
+                      'write': 1}
+    
+    def __init__(self, trace_filename, chunk_size=1 << 20):
+        self.list_type = [Request.Type.read, Request.Type.write]
+        super(BinaryTrace, self).__init__(trace_filename, chunk_size)
+    
+    @staticmethod
+    def is_binary(trace_filename):
+        with open(trace_filename, 'rb') as f:
+            return f.read(len(BinaryTrace.magic)) == BinaryTrace.magic
+    
+    @staticmethod
+    def convert(text_filename, binary_filename, cpu_tick=1, mem_tick=1):
+        # convert a (possibly compressed) text trace to the binary format, whose
+        # arrival cycles are in memory cycles
+        if BinaryTrace.is_binary(text_filename):
+            shutil.copyfile(text_filename, binary_filename)
+            return
+        trace = Trace(text_filename, cpu_tick=cpu_tick, mem_tick=mem_tick)
+        with open(binary_filename, 'wb') as f:
+            f.write(BinaryTrace.magic)
+            buffer = bytearray()
+            for record in trace._read_records():
+                buffer += BinaryTrace._pack(record)
+                if len(buffer) >= trace.chunk_size:
+                    f.write(buffer)
+                    buffer.clear()
+            f.write(buffer)
+    
+    @staticmethod
+    def partition(trace, decode_batch, level, filenames):
+        # split a trace into one binary trace per id of an address level (e.g.,
+        # channel), keeping the order of the requests within every part, and
+        # return the cycle after the last request is sent
+        files = [open(filename, 'wb') for filename in filenames]
+        try:
+            buffers = [bytearray(BinaryTrace.magic) for _ in files]
+            records = trace._read_records()
+            cycle_send = -1
+            while True:
+                chunk = list(itertools.islice(records, trace.chunk_requests))
+                if len(chunk) == 0:
+                    break
+                list_addr_list = decode_batch([record[0] for record in chunk])
+                for (req_addr, req_type, device, cycle_arrive), addr_list in zip(chunk, list_addr_list):
+                    # a simulation of all parts that never stalls sends a request
+                    # per cycle, but none before its arrival cycle
+                    cycle_send = max(cycle_send + 1, cycle_arrive)
+                    i = addr_list[level]
+                    buffers[i] += BinaryTrace._pack((req_addr, req_type, device, cycle_send))
+                    if len(buffers[i]) >= trace.chunk_size:
+                        files[i].write(buffers[i])
+                        buffers[i].clear()
+            for f, buffer in zip(files, buffers):
+                f.write(buffer)
+        finally:
+            for f in files:
+                f.close()
+        return cycle_send + 1
+    
+    @staticmethod
+    def _pack(record):
+        req_addr, req_type, device, cycle_arrive = record
+        return BinaryTrace.record.pack(req_addr, cycle_arrive, 0 if device == '' else int(device),
+                                       BinaryTrace.dict_type2code[req_type.value])
+    
+    def iter_records(self):
+        # raw (address, arrival cycle, device id, type code) tuples
+        with open(self.trace_filename, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                if m[:len(self.magic)] != self.magic:
+                    raise Exception('File {} is not a binary trace.'.format(self.trace_filename))
+                body = memoryview(m)[len(self.magic):]
+                if len(body) % self.record.size != 0:
+                    body.release()
+                    raise Exception('File {} is truncated.'.format(self.trace_filename))
+                records = self.record.iter_unpack(body)
+                try:
+                    for record in records:
+                        yield record
+                finally:
+                    # the mapping can only be closed once nothing refers to it
+                    del records
+                    body.release()
+    
+    def _read_records(self):
+        for req_addr, cycle_arrive, device, type_code in self.iter_records():
+            yield req_addr, self.list_type[type_code], '' if device == 0 else str(device), cycle_arrive
+
+
+class CommandTrace(object):
+    # The commands issued to a channel: an 8-byte magic number, the channel id
+    # and the number of address levels, followed by one fixed-width
+    # little-endian record per command: the cycle, the command and the address
+    # list (-1 below the scope of the command). The records are buffered and
+    # written every chunk_size bytes, so the memory stays bounded.
+    magic = b'DRAMCMD1'
+    header = struct.Struct('<HB5x')
+    
+    def __init__(self, filename, channel_id, num_levels, chunk_size=1 << 20):
+        self.record = CommandTrace.get_record(num_levels)
+        self.chunk_size = chunk_size
+        self._file = open(filename, 'wb')
+        self._file.write(self.magic + self.header.pack(channel_id, num_levels))
+        self._buffer = bytearray()
+    
+    @staticmethod
+    def get_record(num_levels):
+        return struct.Struct('<qB3x' + 'i' * num_levels)
+    
+    def write(self, cycle, cmd_value, addr_list):
+        self._buffer += self.record.pack(cycle, cmd_value, *addr_list)
+        if len(self._buffer) >= self.chunk_size:
+            self._file.write(self._buffer)
+            self._buffer.clear()
+    
+    def close(self):
+        self._file.write(self._buffer)
+        self._buffer.clear()
+        self._file.close()
+    
+    @staticmethod
+    def read(filename):
+        # the channel id and an iterator over the (cycle, command value, address list) records
+        with open(filename, 'rb') as f:
+            head = f.read(len(CommandTrace.magic) + CommandTrace.header.size)
+        if not head.startswith(CommandTrace.magic):
+            raise Exception('File {} is not a command trace.'.format(filename))
+        channel_id, num_levels = CommandTrace.header.unpack(head[len(CommandTrace.magic):])
+        return channel_id, CommandTrace._iter_records(filename, len(head), CommandTrace.get_record(num_levels))
+    
+    @staticmethod
+    def _iter_records(filename, offset, record):
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            while True:
+                chunk = f.read(record.size * 4096)
+                if len(chunk) % record.size != 0:
+                    raise Exception('File {} is truncated.'.format(filename))
+                if len(chunk) == 0:
+                    return
+                for values in record.iter_unpack(chunk):
+                    yield values[0], values[1], list(values[2:])
 
 
 class Request(object):
@@ -36,6 +261,7 @@ class Request(object):
         read = 'read'
         write = 'write'
         refresh = 'refresh'
+        refresh_bank = 'refresh_bank'
         powerdown = 'powerdown'
         selfrefresh = 'selfrefresh'
         extension = 'extension'
@@ -63,6 +289,7 @@ class Request(object):
         else:
             raise Exception(addr)
         
+        self.cycle_inject = -1  # the cycle given by the trace, -1 to send it right away
         self.cycle_arrive = None  # type: int
         self.cycle_depart = None  # type: int
         
@@ -101,3 +328,55 @@ class Queue(object):
             self.queue_req.append(req)
         else:
             self.queue_req.insert(i, req)
+
+
+class RequestQueue(object):
+    # A queue of requests in arrival order, also indexed by bank, by row and by
+    # address so that removing a request and looking up the requests to the same
+    # bank, row or address take O(1). len_bank and len_row are the lengths of the
+    # address list prefixes that identify a bank and a row.
+    def __init__(self, len_bank, len_row, max=32):
+        self.queue_req = {}  # type: Dict[Request, None]
+        self.max = max
+        self.len_bank = len_bank
+        self.len_row = len_row
+        self._by_bank = {}  # type: Dict[tuple, Dict[Request, None]]
+        self._by_row = {}  # type: Dict[tuple, Dict[Request, None]]
+        self._by_addr = {}  # type: Dict[int, int]
+    
+    def size(self):
+        return len(self.queue_req)
+    
+    def push_i(self, req: Request):
+        assert req not in self.queue_req
+        self.queue_req[req] = None
+        self._by_bank.setdefault(tuple(req.addr_list[:self.len_bank]), {})[req] = None
+        self._by_row.setdefault(tuple(req.addr_list[:self.len_row]), {})[req] = None
+        self._by_addr[req.addr_int] = self._by_addr.get(req.addr_int, 0) + 1
+    
+    def remove(self, req: Request):
+        del self.queue_req[req]
+        self._discard(self._by_bank, tuple(req.addr_list[:self.len_bank]), req)
+        self._discard(self._by_row, tuple(req.addr_list[:self.len_row]), req)
+        if self._by_addr[req.addr_int] == 1:
+            del self._by_addr[req.addr_int]
+        else:
+            self._by_addr[req.addr_int] -= 1
+    
+    def get_bank(self, bank_group):
+        # the requests to the bank whose address list starts with bank_group
+        return self._by_bank.get(tuple(bank_group), {})
+    
+    def get_row(self, row_group):
+        # the requests to the row whose address list starts with row_group
+        return self._by_row.get(tuple(row_group), {})
+    
+    def count_addr(self, addr_int):
+        return self._by_addr.get(addr_int, 0)
+    
+    @staticmethod
+    def _discard(index, key, req):
+        bucket = index[key]
+        del bucket[req]
+        if len(bucket) == 0:
+            del index[key]
@@ -1,10 +1,10 @@
-from typing import List, Dict, Any
+from typing import List, Dict
+from collections import deque
 
 
 class DRAM(object):
     def __init__(self, t_spec, args, level, id_: int):
         from offchip.standard.spec_base import BaseSpec
-        from offchip.controller import Controller
         self.print = args.print
         self.args = args
         
@@ -33,8 +33,20 @@ class DRAM(object):
         self._rowopen = self.t_spec.rowopen[self.level]
         self._lambda = self.t_spec.lambda_[self.level]
         self._timing = self.t_spec.timing[self.level]
-        self._prev = {cmd: Controller.Queue() for cmd in self.t_spec.cmd}
-        self._next = [-1 for _ in self.t_spec.cmd]
+        self._prev = [deque() for _ in self.t_spec.cmd]  # type: List[deque]
+        
+        # The _next deadlines of all nodes of a channel are kept in one flat list
+        # owned by the channel: the deadline of cmd at this node is
+        # _flat_next[_next_base + cmd.value]. See _build_flat_timing().
+        self._flat_next = [-1 for _ in self.t_spec.cmd]  # type: List[int]
+        self._next_base = 0
+        self._check_path = [{} for _ in self.t_spec.cmd]  # type: List[Dict[tuple, tuple]]
+        self._path_begin = self.level.value + 1
+        self._path_end = self._path_begin
+        # per command, the timing entries as flat indices (see _build_timing_effects)
+        self._timing_target = [() for _ in self.t_spec.cmd]  # type: List[tuple]
+        self._timing_sibling = [() for _ in self.t_spec.cmd]  # type: List[tuple]
+        self._timing_has_sibling = [False for _ in self.t_spec.cmd]  # type: List[bool]
         
         self._num_cycles_busy = 0
         self._num_cycles_active = 0
@@ -44,17 +56,17 @@ class DRAM(object):
         self._avg_reqs_served = 0
         
         self.initialize()
+        if self.level == self.t_spec.level.channel:
+            self._build_flat_timing()
     
     def initialize(self):
-        from offchip.controller import Controller
-        self._prev: Dict[Any, Controller.Queue]
-        
+        # the cycles of the last issues of every command, the most recent first
         for cmd in self.t_spec.cmd:
             dist = 0
             for t in self._timing[cmd]:
                 dist = max(dist, t.dist)
             if dist > 0:
-                self._prev[cmd].resize(dist, -1)
+                self._prev[cmd.value] = deque([-1 for _ in range(dist)], maxlen=dist)
         
         child_level = self.t_spec.level(self.level.value + 1)
         if child_level == self.t_spec.level.row:
@@ -70,6 +82,68 @@ class DRAM(object):
             child.parent = self
             self.children.append(child)
     
+    def _build_flat_timing(self):
+        # lay out the deadlines of this subtree, one row of commands per node
+        nodes = []
+        stack = [self]
+        while len(stack) > 0:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(reversed(node.children))
+        
+        num_cmds = len(self.t_spec.cmd)
+        flat_next = [-1 for _ in range(len(nodes) * num_cmds)]
+        for i in range(len(nodes)):
+            node = nodes[i]
+            flat_next[i * num_cmds:(i + 1) * num_cmds] = node._flat_next[node._next_base:node._next_base + num_cmds]
+            node._flat_next = flat_next
+            node._next_base = i * num_cmds
+            node._check_path = [{} for _ in self.t_spec.cmd]
+        # children first, their parents look at the sibling entries of them
+        for node in reversed(nodes):
+            node._build_timing_effects()
+        
+        # the part of an address list that selects the nodes below this one
+        node = self
+        self._path_end = self._path_begin
+        while len(node.children) > 0:
+            node = node.children[0]
+            self._path_end += 1
+    
+    def _build_timing_effects(self):
+        # Resolve the timing entries of every command into (distance, flat index,
+        # value, ...) tuples once, split by whether they apply to this node when
+        # it is on the path of the command (target) or next to it (sibling).
+        for cmd in self.t_spec.cmd:
+            target, sibling = [], []
+            for t in self._timing[cmd]:
+                i = self._next_base + t.cmd.value
+                if t.sibling:
+                    assert t.dist == 1
+                    sibling.append((i, t.val))
+                else:
+                    is_refresh = self.t_spec.is_refreshing(cmd) and self.t_spec.is_opening(t.cmd)
+                    target.append((t.dist - 1, i, t.val, is_refresh))
+            self._timing_target[cmd.value] = tuple(target)
+            self._timing_sibling[cmd.value] = tuple(sibling)
+        
+        # all children are of the same level, so they share their timing entries
+        if len(self.children) > 0:
+            for cmd in self.t_spec.cmd:
+                self._timing_has_sibling[cmd.value] = len(self.children[0]._timing_sibling[cmd.value]) > 0
+    
+    def _get_check_path(self, cmd, addr_list):
+        # flat indices of the deadlines that check() has to compare against
+        path = []
+        node = self
+        while True:
+            path.append(node._next_base + cmd.value)
+            child_id = addr_list[node.level.value + 1]
+            if child_id < 0 or node.level == self.t_spec.scope[cmd.value] or \
+                    len(node.children) == 0:
+                return tuple(path)
+            node = node.children[child_id]
+    
     def insert(self, child):
         child: DRAM
         child.parent = self
@@ -92,18 +166,29 @@ class DRAM(object):
         return self.children[child_id].decode(cmd, addr_list)
     
     def check(self, cmd, addr_list, cycle_current):
-        if self._next[cmd.value] != -1 and cycle_current < self._next[cmd.value]:
-            # stop recursion: the check failed at this level
-            return False
-        
-        child_id = addr_list[self.level.value + 1]
-        if child_id < 0 or self.level == self.t_spec.scope[cmd.value] or \
-                len(self.children) == 0:
-            # stop recursion: the check passed at all levels
-            return True
+        # The nodes visited from here down to the scope of cmd only depend on the
+        # address, so their deadlines are looked up once and then read directly.
+        # An unset deadline is -1 and never fails the check.
+        paths = self._check_path[cmd.value]
+        key = tuple(addr_list[self._path_begin:self._path_end])
+        path = paths.get(key)
+        if path is None:
+            path = paths[key] = self._get_check_path(cmd, addr_list)
         
-        # recursively check my child
-        return self.children[child_id].check(cmd, addr_list, cycle_current)
+        flat_next = self._flat_next
+        for i in path:
+            if cycle_current < flat_next[i]:
+                return False
+        return True
+    
+    def get_next_ready_cycle(self, cmd, addr_list):
+        # the earliest cycle at which check() passes, assuming no further updates
+        paths = self._check_path[cmd.value]
+        key = tuple(addr_list[self._path_begin:self._path_end])
+        path = paths.get(key)
+        if path is None:
+            path = paths[key] = self._get_check_path(cmd, addr_list)
+        return max(self._flat_next[i] for i in path)
     
     def check_row_hit(self, cmd, addr_list):
         child_id = addr_list[self.level.value + 1]
@@ -150,57 +235,67 @@ class DRAM(object):
         self.children[child_id]._update_state(cmd, addr_list)
     
     def _update_timing(self, cmd, addr_list, cycle_curr):
-        from offchip.standard.spec_data_structure import TimingEntry
-        self._timing: Dict[Any, List[TimingEntry]]
-        
+        # Only the nodes on the path of the address have constraints of their own
+        # to update. Their other children only take the sibling constraints, which
+        # are resolved per level in advance (HBM has none), so the rest of the
+        # tree is never visited.
+        cmd_value = cmd.value
         if self.id_ != addr_list[self.level.value]:
-            for t in self._timing[cmd]:
-                if not t.sibling:
-                    # not an applicable timing parameter
-                    continue
-                
-                # update future
-                assert t.dist == 1
-                future = cycle_curr + t.val
-                self._next[t.cmd.value] = max(self._next[t.cmd.value], future)
-            
-            # stop recursion: only target nodes should be recursed
+            self._update_timing_sibling(cmd_value, cycle_curr)
             return
         
-        from offchip.controller import Controller
-        self._prev: Dict[Any, Controller.Queue]
-        if self._prev[cmd].size() > 0:
-            self._prev[cmd].pop_i(-1)
-            self._prev[cmd].push_i(cycle_curr, 0)
+        node = self
+        while True:
+            node._update_timing_target(cmd, cmd_value, cycle_curr)
+            
+            # Some commands have timings that are higher that their scope levels, thus
+            # we do not stop at the cmd's scope level
+            if len(node.children) == 0:
+                # stop: updated all levels
+                return
+            
+            child_id = addr_list[node._path_begin]
+            if node._timing_has_sibling[cmd_value]:
+                for child in node.children:
+                    if child.id_ != child_id:
+                        child._update_timing_sibling(cmd_value, cycle_curr)
+            
+            if child_id < 0 or child_id >= len(node.children):
+                # stop: no child is a target node
+                return
+            node = node.children[child_id]
+    
+    def _update_timing_sibling(self, cmd_value, cycle_curr):
+        flat_next = self._flat_next
+        for i, val in self._timing_sibling[cmd_value]:
+            future = cycle_curr + val
+            if future > flat_next[i]:
+                flat_next[i] = future
+    
+    def _update_timing_target(self, cmd, cmd_value, cycle_curr):
+        prev = self._prev[cmd_value]
+        if len(prev) > 0:
+            # the oldest issue falls off the end
+            prev.appendleft(cycle_curr)
         
-        for t in self._timing[cmd]:
-            if t.sibling:
-                continue
-            past = self._prev[cmd].queue_req[t.dist - 1]
+        flat_next = self._flat_next
+        for dist_i, i, val, is_refresh in self._timing_target[cmd_value]:
+            past = prev[dist_i]
             if past < 0:
                 continue
             
-            future = past + t.val
+            future = past + val
             if self.print:
-                print(' {}-{}-{}-{}-{}-k'.format(self.level.value, cmd.value, past, t.val, self._next[t.cmd.value]))
-            self._next[t.cmd.value] = max(self._next[t.cmd.value], future)
-            if self.t_spec.is_refreshing(cmd) and self.t_spec.is_opening(t.cmd):
+                print(' {}-{}-{}-{}-{}-k'.format(self.level.value, cmd.value, past, val, flat_next[i]))
+            if future > flat_next[i]:
+                flat_next[i] = future
+            if is_refresh:
                 assert past == cycle_curr
                 self.begin_of_refreshing = cycle_curr
-                self.end_of_refreshing = max(self.end_of_refreshing, self._next[t.cmd.value])
+                self.end_of_refreshing = max(self.end_of_refreshing, flat_next[i])
                 self._num_cycles_refresh += self.end_of_refreshing - cycle_curr
                 if self.cur_serving_requests > 0:
                     self.refresh_intervals.append([self.begin_of_refreshing, self.end_of_refreshing])
-        
-        # Some commands have timings that are higher that their scope levels, thus
-        # we do not stop at the cmd's scope level
-        if len(self.children) == 0:
-            # stop recursion: updated all levels
-            return
-        
-        # recursively update *all* of the children
-        for child in self.children:
-            child._update_timing(cmd, addr_list, cycle_curr)
     
     def update_serving_requests(self, addr_list, delta, cycle_curr):
         assert self.id_ == addr_list[self.level.value]
@@ -250,6 +345,27 @@ class DRAM(object):
         for child in self.children:
             child.finish(num_cycles)
     
+    def add_statistics(self, group):
+        # add the statistics of this node to group, and a subgroup for every child
+        group.add_scalar('num_cycles_busy', self._num_cycles_busy,
+                         'The cycles serving requests or refreshing')
+        group.add_scalar('num_cycles_active', self._num_cycles_active,
+                         'The cycles serving requests')
+        group.add_scalar('num_cycles_refresh', self._num_cycles_refresh,
+                         'The cycles refreshing')
+        group.add_scalar('num_cycles_overlap', self._num_cycles_overlap,
+                         'The cycles both serving requests and refreshing')
+        group.add_scalar('serving_requests', self.serving_requests,
+                         'The sum of the requests in service over the cycles')
+        for child in self.children:
+            group.add(child.get_statistic_group())
+    
+    def get_statistic_group(self):
+        from configs.stat_data_structure import StatisticGroup
+        group = StatisticGroup().set_name('{}{}'.format(self.level.name, self.id_))
+        self.add_statistics(group)
+        return group
+    
     def get_state(self):
         return self._state
     
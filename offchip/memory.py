@@ -1,21 +1,70 @@
-import copy
 from typing import List
 from configs import strings, config
 from configs.stat_data_structure import ScalarStatistic
 from offchip.data_structure import Request
 
 
+class AddressMapping(object):
+    def __init__(self, spec, type_):
+        from offchip.standard import BaseSpec
+        self.type_ = type_
+        self.tx_bits = None  # type: int
+        self.addr_bits = []  # type: List[int]
+        
+        sz = spec.org_entry.count
+        tx = spec.prefetch_size * spec.channel_width / 8
+        self.tx_bits = config.calc_log2(int(tx))
+        assert (1 << self.tx_bits) == tx
+        
+        for level_i in range(len(BaseSpec.level)):
+            self.addr_bits.append(config.calc_log2(sz[level_i]))
+        self.addr_bits[-1] -= config.calc_log2(spec.prefetch_size)
+        
+        # the order in which the levels are sliced off the lower bits
+        num_levels = len(self.addr_bits)
+        if self.type_ == strings.memory_type_ChRaBaRoCo:
+            order = list(range(num_levels - 1, -1, -1))
+        elif self.type_ == strings.memory_type_RoBaRaCoCh:
+            order = [0, num_levels - 1] + list(range(1, num_levels - 1))
+        else:
+            raise Exception(self.type_)
+        
+        # (shift, mask) of every level, so that decoding needs no loop over the slices
+        self._fields = [None for _ in range(num_levels)]
+        shift = self.tx_bits
+        for level_i in order:
+            self._fields[level_i] = (shift, (1 << self.addr_bits[level_i]) - 1)
+            shift += self.addr_bits[level_i]
+    
+    def decode(self, addr_int):
+        return [(addr_int >> shift) & mask for shift, mask in self._fields]
+    
+    def encode(self, addr_list):
+        # the address that decodes to addr_list (the bits below tx_bits are zero)
+        addr_int = 0
+        for (shift, mask), addr in zip(self._fields, addr_list):
+            addr_int |= (addr & mask) << shift
+        return addr_int
+    
+    def decode_batch(self, list_addr_int):
+        # decode a whole chunk of addresses one level at a time
+        columns = [[(addr_int >> shift) & mask for addr_int in list_addr_int]
+                   for shift, mask in self._fields]
+        return [list(addr_list) for addr_list in zip(*columns)]
+
+
 # MemoryAccessHandler
 class Memory(object):
     from offchip.controller import Controller
-    initialized = False
+    
+    # the address mapping, also of the traces that are built or partitioned by channel
+    type_ = strings.memory_type_RoBaRaCoCh
     
     def __init__(self, args_, ctrls: List[Controller]):
         from offchip.standard import BaseSpec
         self.print = args_.print
         self.flag_stall = False
         self.translation = strings.translation_none
-        self.type_ = strings.memory_type_RoBaRaCoCh
         self.tx_bits = None  # type: int
         
         self._num_reads_device = {}
@@ -31,10 +80,9 @@ class Memory(object):
         self.ctrls = []  # type: List[Memory.Controller]
         self.spec = None  # type: BaseSpec
         
-        assert Memory.initialized == False
-        Memory.initialized = True
-        
         self.ctrls = ctrls
+        # the controllers may simulate a subset of the channels (see main_parallel)
+        self._ctrl_by_channel = {ctrl.channel.id_: ctrl for ctrl in ctrls}
         self.spec = ctrls[0].spec
         assert args_.name_spec == self.spec.name_spec
         
@@ -42,16 +90,14 @@ class Memory(object):
         assert (sz[0] & (sz[0] - 1)) == 0
         assert (sz[1] & (sz[1] - 1)) == 0
         
-        tx = self.spec.prefetch_size * self.spec.channel_width / 8
-        self.tx_bits = config.calc_log2(int(tx))
-        assert (1 << self.tx_bits) == tx
+        self.mapping = AddressMapping(self.spec, self.type_)
+        self.tx_bits = self.mapping.tx_bits
+        self._addr_bits = self.mapping.addr_bits
         
         self._max_address = self.spec.channel_width / 8
         for level_i in range(len(BaseSpec.level)):
-            self._addr_bits.append(config.calc_log2(sz[level_i]))
             if sz[level_i] != 0:
                 self._max_address *= sz[level_i]
-        self._addr_bits[-1] -= config.calc_log2(self.spec.prefetch_size)
         self._max_address = None
         
         if args_.translation != strings.translation_none:
@@ -66,35 +112,22 @@ class Memory(object):
         self._num_cycles_active \
             .set_name('num_cycles_active') \
             .set_desc('The number of cycles that the DRAM is active (serving R/W)')
+        self._max_bandwidth \
+            .set_name('max_bandwidth') \
+            .set_desc('The peak bandwidth of the DRAM in bytes per second')
     
     def send(self, request: Request):
         from offchip.standard import BaseSpec
         type_ = request.type
         device = request.device
-        addr_int = copy.deepcopy(request.addr_int)
         
-        addr_int = config.clear_lower_bits(addr_int, self.tx_bits)
-        
-        # separate the address according to the level
-        for i in range(len(self._addr_bits)):
-            request.addr_list.append(None)
-        if self.type_ == strings.memory_type_ChRaBaRoCo:
-            for i in range(len(self._addr_bits) - 1, -1, -1):
-                request.addr_list[i], addr_int = config.slice_lower_bits(
-                    addr_int, self._addr_bits[i])
-        elif self.type_ == strings.memory_type_RoBaRaCoCh:
-            request.addr_list[0], addr_int = config.slice_lower_bits(
-                addr_int, self._addr_bits[0])
-            request.addr_list[-1], addr_int = config.slice_lower_bits(
-                addr_int, self._addr_bits[-1])
-            for i in range(1, len(self._addr_bits) - 1):
-                request.addr_list[i], addr_int = config.slice_lower_bits(
-                    addr_int, self._addr_bits[i])
-        else:
-            raise Exception(self.type_)
+        # separate the address according to the level, unless the trace reader
+        # has already decoded it together with the rest of its chunk
+        if len(request.addr_list) == 0:
+            request.addr_list = self.mapping.decode(request.addr_int)
         
         # enqueue the request and update the statistic
-        if self.ctrls[request.addr_list[0]].enqueue(request) is True:
+        if self._ctrl_by_channel[request.addr_list[0]].enqueue(request) is True:
             # request enqueued successfully
             self.flag_stall = False
             if type_ == Request.Type.read:
@@ -104,7 +137,7 @@ class Memory(object):
                     self._num_reads_device[device] += 1
                 
                 idx_channel = request.addr_list[BaseSpec.level.channel.value]
-                if device not in self._num_reads_channel.keys():
+                if idx_channel not in self._num_reads_channel.keys():
                     self._num_reads_channel[idx_channel] = 1
                 else:
                     self._num_reads_channel[idx_channel] += 1
@@ -132,19 +165,105 @@ class Memory(object):
         if is_active is True:
             self._num_cycles_active.scalar += 1
     
+    def run(self, num_cycles):
+        # Simulate num_cycles cycles, exactly like as many calls to cycle(), and
+        # return the requests completed in them. A controller in which nothing
+        # happens is left alone until its next event and then catches up on the
+        # skipped cycles at once, so idle channels cost next to nothing.
+        if num_cycles <= 0:
+            return []
+        if self.print or num_cycles == 1:
+            # a single cycle has nothing to skip
+            completed = []
+            for ctrl in self.ctrls:
+                ctrl.completed = completed
+            for _ in range(num_cycles):
+                self.cycle()
+            for ctrl in self.ctrls:
+                ctrl.completed = None
+            return completed
+        
+        ctrls = self.ctrls
+        completed = []
+        cycle_begin = self._num_cycles.scalar
+        cycle_end = cycle_begin + num_cycles
+        # per controller, the cycle of its next event and whether it is active until then
+        list_cycle_event = [cycle_begin + 1 for _ in ctrls]
+        list_is_active = [ctrl.is_active() for ctrl in ctrls]
+        num_cycles_active = 0
+        for ctrl in ctrls:
+            ctrl.completed = completed
+        
+        cycle = cycle_begin
+        while cycle < cycle_end:
+            cycle_next = min(list_cycle_event)
+            if cycle_next > cycle + 1:
+                # every controller idles until cycle_next, so the activity stays as is
+                num_skipped = min(cycle_next - 1, cycle_end) - cycle
+                if True in list_is_active:
+                    num_cycles_active += num_skipped
+                cycle += num_skipped
+                if cycle == cycle_end:
+                    break
+            
+            cycle += 1
+            is_active = False
+            for i, ctrl in enumerate(ctrls):
+                if cycle < list_cycle_event[i]:
+                    is_active = is_active or list_is_active[i]
+                    continue
+                
+                if ctrl.cycle_curr < cycle - 1:
+                    ctrl.skip_cycles(cycle - 1 - ctrl.cycle_curr)
+                is_active = is_active or ctrl.is_active()
+                num_cmds_issued = ctrl.num_cmds_issued
+                num_completed = len(completed)
+                ctrl.cycle()
+                if cycle < cycle_end and ctrl.num_cmds_issued == num_cmds_issued and \
+                        len(completed) == num_completed:
+                    # nothing was served, so the controller may idle for a while
+                    list_cycle_event[i] = ctrl.get_next_event_cycle()
+                    list_is_active[i] = ctrl.is_active()
+                else:
+                    list_cycle_event[i] = cycle + 1
+            if is_active:
+                num_cycles_active += 1
+        
+        for ctrl in ctrls:
+            if ctrl.cycle_curr < cycle_end:
+                ctrl.skip_cycles(cycle_end - ctrl.cycle_curr)
+            ctrl.completed = None
+        self._num_cycles.scalar = cycle_end
+        self._num_cycles_active.scalar += num_cycles_active
+        return completed
+    
+    def get_next_event_cycle(self):
+        return min(ctrl.get_next_event_cycle() for ctrl in self.ctrls)
+    
+    def skip_to(self, num_cycle):
+        # Fast-forward to num_cycle without simulating the cycles in between,
+        # which is exact only if no event happens before num_cycle + 1
+        num_cycles = num_cycle - self.get_num_cycle()
+        if num_cycles <= 0:
+            return
+        self._num_cycles.scalar += num_cycles
+        # no request starts or completes while idle, so the activity stays unchanged
+        for ctrl in self.ctrls:
+            if ctrl.is_active():
+                self._num_cycles_active.scalar += num_cycles
+                break
+        for ctrl in self.ctrls:
+            ctrl.skip_cycles(num_cycles)
+    
     def finish(self):
         from offchip.standard import BaseSpec
         spec = self.spec
         sz = spec.org_entry.count
         idx_channel = BaseSpec.level.channel.value
-        self._max_bandwidth = \
+        self._max_bandwidth.scalar = \
             spec.speed_entry.rate * 1e6 * spec.channel_width * sz[idx_channel] / 8
         for ctrl in self.ctrls:
-            if ctrl.channel.id_ not in self._num_reads_channel.keys():
-                num_reads = 0
-            else:
-                num_reads = self._num_reads_channel[ctrl.channel.id_]
-            ctrl.finish(num_reads)
+            ctrl.finish()
     
     def set_high_writeq_watermark(self, mark):
         for ctrl in self.ctrls:
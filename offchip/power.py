@@ -0,0 +1,129 @@
+from configs.stat_data_structure import StatisticGroup
+
+
+class Power(object):
+    # The energy of a channel in pJ (mA * V * ns) from the IDD currents of the
+    # spec, as in the Micron power calculator: every command adds its energy
+    # above the standby current, and every rank adds the background energy of
+    # the states it was in. A rank only changes its state with a command to it,
+    # so the cycles in a state are accumulated when a command is issued and
+    # nothing is done per cycle. It only sees the commands to its channel, so
+    # that it also accounts for the commands replayed from a command trace.
+    from offchip.dram_module import DRAM
+    from offchip.standard import BaseSpec as t_spec
+    
+    # the background states of a rank
+    list_states = ['act_standby', 'pre_standby', 'act_powerdown', 'pre_powerdown', 'selfrefresh']
+    act_standby, pre_standby, act_powerdown, pre_powerdown, selfrefresh = range(5)
+    
+    def __init__(self, channel):
+        self.channel = channel  # type: Power.DRAM
+        spec = channel.t_spec
+        s = spec.speed_entry
+        p = spec.power_entry
+        cmd = Power.t_spec.cmd
+        count = spec.org_entry.count
+        num_banks = count[Power.t_spec.level.bankgroup.value] * count[Power.t_spec.level.bank.value]
+        
+        self.calibrated = p.calibrated
+        self.level_rank = Power.t_spec.level.rank.value
+        self.energy_pre = (p.idd0 - p.idd2n) * s.nRP * s.tCK * p.vdd
+        energy_rd = (p.idd4r - p.idd3n) * s.nBL * s.tCK * p.vdd
+        energy_wr = (p.idd4w - p.idd3n) * s.nBL * s.tCK * p.vdd
+        energy_ref = (p.idd5b - p.idd3n) * s.nRFC * s.tCK * p.vdd
+        # the energy of every command, but PREA, whose energy depends on the open banks
+        self.energy_cmd = [0.0 for _ in cmd]
+        self.energy_cmd[cmd.act.value] = (p.idd0 - p.idd3n) * s.nRAS * s.tCK * p.vdd
+        self.energy_cmd[cmd.pre.value] = self.energy_pre
+        self.energy_cmd[cmd.rd.value] = energy_rd
+        self.energy_cmd[cmd.wr.value] = energy_wr
+        self.energy_cmd[cmd.rda.value] = energy_rd + self.energy_pre
+        self.energy_cmd[cmd.wra.value] = energy_wr + self.energy_pre
+        self.energy_cmd[cmd.ref.value] = energy_ref
+        # the spec has no per-bank tRFC and times a REFSB with nRFC as well, so a
+        # REFSB is taken as refreshing its share of the banks of a REF
+        self.energy_cmd[cmd.refsb.value] = energy_ref / num_banks
+        # the background power of every state in pJ per cycle
+        self.power_state = [i * s.tCK * p.vdd for i in [p.idd3n, p.idd2n, p.idd3p, p.idd2p, p.idd6]]
+        
+        # the energy by the kind of command
+        self.energy_act = 0.0
+        self.energy_pre_all = 0.0
+        self.energy_rd = 0.0
+        self.energy_wr = 0.0
+        self.energy_ref = 0.0
+        
+        num_ranks = max(count[self.level_rank], 1)
+        self.num_banks_open = [0 for _ in range(num_ranks)]
+        self.state = [Power.pre_standby for _ in range(num_ranks)]
+        self.cycle_state = [0 for _ in range(num_ranks)]  # the cycle the rank entered its state
+        self.cycles_state = [[0 for _ in Power.list_states] for _ in range(num_ranks)]
+    
+    def update(self, cmd, addr_list, cycle_curr):
+        cmd_ = Power.t_spec.cmd
+        rank = addr_list[self.level_rank]
+        self._account(rank, cycle_curr)
+        
+        energy = self.energy_cmd[cmd.value]
+        if cmd == cmd_.act:
+            self.num_banks_open[rank] += 1
+            self.energy_act += energy
+        elif cmd in [cmd_.pre, cmd_.rda, cmd_.wra]:
+            self.num_banks_open[rank] -= 1
+            self.energy_pre_all += self.energy_pre
+            if cmd == cmd_.rda:
+                self.energy_rd += energy - self.energy_pre
+            elif cmd == cmd_.wra:
+                self.energy_wr += energy - self.energy_pre
+        elif cmd == cmd_.prea:
+            self.energy_pre_all += self.energy_pre * self.num_banks_open[rank]
+            self.num_banks_open[rank] = 0
+        elif cmd == cmd_.rd:
+            self.energy_rd += energy
+        elif cmd == cmd_.wr:
+            self.energy_wr += energy
+        elif cmd in [cmd_.ref, cmd_.refsb]:
+            self.energy_ref += energy
+        
+        if cmd == cmd_.pde:
+            self.state[rank] = Power.act_powerdown if self.num_banks_open[rank] > 0 else Power.pre_powerdown
+        elif cmd == cmd_.sre:
+            self.state[rank] = Power.selfrefresh
+        elif cmd in [cmd_.pdx, cmd_.srx] or self.state[rank] in [Power.act_standby, Power.pre_standby]:
+            self.state[rank] = Power.act_standby if self.num_banks_open[rank] > 0 else Power.pre_standby
+    
+    def finish(self, cycle_curr):
+        for rank in range(len(self.state)):
+            self._account(rank, cycle_curr)
+    
+    def get_energy_background(self):
+        return sum(sum(cycles * power for cycles, power in zip(cycles_state, self.power_state))
+                   for cycles_state in self.cycles_state)
+    
+    def get_energy(self):
+        return self.energy_act + self.energy_pre_all + self.energy_rd + self.energy_wr + self.energy_ref + \
+               self.get_energy_background()
+    
+    def get_statistic_group(self):
+        group = StatisticGroup().set_name('power')
+        group.add_scalar('calibrated', int(self.calibrated),
+                         'Whether the currents of the spec are those of a datasheet, else the energy is only relative')
+        group.add_scalar('energy', self.get_energy(), 'The energy of the channel in pJ')
+        group.add_scalar('energy_act', self.energy_act, 'The energy of the activations in pJ')
+        group.add_scalar('energy_pre', self.energy_pre_all, 'The energy of the precharges in pJ')
+        group.add_scalar('energy_rd', self.energy_rd, 'The energy of the reads in pJ')
+        group.add_scalar('energy_wr', self.energy_wr, 'The energy of the writes in pJ')
+        group.add_scalar('energy_ref', self.energy_ref, 'The energy of the refreshes in pJ')
+        group.add_scalar('energy_background', self.get_energy_background(),
+                         'The energy of the ranks in their standby, power-down and self-refresh states in pJ')
+        for rank, cycles_state in enumerate(self.cycles_state):
+            group_rank = StatisticGroup().set_name('rank{}'.format(rank))
+            for name, cycles in zip(Power.list_states, cycles_state):
+                group_rank.add_scalar('cycles_{}'.format(name), cycles, 'The cycles in {}'.format(name))
+            group.add(group_rank)
+        return group
+    
+    def _account(self, rank, cycle_curr):
+        # the cycles up to cycle_curr were spent in the current state
+        self.cycles_state[rank][self.state[rank]] += cycle_curr - self.cycle_state[rank]
+        self.cycle_state[rank] = cycle_curr
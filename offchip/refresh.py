@@ -1,3 +1,4 @@
+from configs import strings
 from offchip.data_structure import Request
 
 
@@ -5,13 +6,36 @@ class Refresh(object):
     from offchip.controller import Controller
     from offchip.standard import BaseSpec as t_spec
     
+    # In the rank mode, every rank is refreshed (REF) every nREFI cycles. In the
+    # bank mode, every nREFI / (banks of a rank) cycles a refresh (REFSB) of the
+    # next bank of every rank, in turn, is added to the backlog of the bank, so
+    # that every bank is refreshed at least every nREFI. A refresh in the backlog
+    # is postponed while its bank has queued row hits, until the backlog reaches
+    # __backlog_max, and while the controller is idle, refreshes are pulled in,
+    # one per rank every interval, until the backlog falls to
+    # __backlog_early_pull_threshold. A REFSB is only queued when its first
+    # command is ready, so it does not hold up the other banks from the
+    # precedence of the "other" queue.
     def __init__(self, ctrl, ):
         self.ctrl = ctrl  # type: Refresh.Controller
+        args = ctrl.channel.args
+        if args.refresh_mode not in ['rank', 'bank']:
+            raise Exception(args.refresh_mode)
+        self.b_ref_rank = args.refresh_mode == 'rank'
         
         self.cycle_last_refreshed = 0
         self.cycle_current = 0
+        count = self.ctrl.channel.t_spec.org_entry.count
         self.cnt_max_rank = len(self.ctrl.channel.children)
-        self.cnt_max_bank = self.ctrl.channel.t_spec.org_entry.count[Refresh.t_spec.level.bank.value]
+        self.cnt_max_bank_bg = count[Refresh.t_spec.level.bank.value]
+        # the banks of a rank, over its bank groups
+        self.cnt_max_bank = count[Refresh.t_spec.level.bankgroup.value] * self.cnt_max_bank_bg
+        # the cycles between two refreshes of a rank, in the bank mode those of its next bank
+        nREFI = self.ctrl.channel.t_spec.speed_entry.nREFI
+        self.refresh_interval = nREFI
+        if self.b_ref_rank is False:
+            self.refresh_interval = nREFI // self.cnt_max_bank
+            assert 0 < self.refresh_interval * self.cnt_max_bank <= nREFI
         
         self.bank_ref_counters = []
         self.__bank_refresh_backlog = []
@@ -28,33 +52,149 @@ class Refresh(object):
         self.level_rank = Refresh.t_spec.level.rank.value
         self.level_bank = Refresh.t_spec.level.bank.value
         self.level_sa = -1
+        
+        # the address list of every bank of every rank, and the banks with a refresh due
+        self._cmd_refsb = Refresh.t_spec.cmd.refsb
+        self._bank_addr_lists = [[self._get_addr_list(ctrl, rank, bank // self.cnt_max_bank_bg,
+                                                      bank % self.cnt_max_bank_bg)
+                                  for bank in range(self.cnt_max_bank)] for rank in range(self.cnt_max_rank)]
+        self._num_banks_due = 0
+        self._backlog_pull_in_min = max(self.__backlog_early_pull_threshold, self.__backlog_min)
+        self._cycle_last_pulled_in = [0 for _ in range(self.cnt_max_rank)]
+        
+        # statistics
+        self.num_refreshes = 0
+        self.num_refreshes_postponed = 0  # the intervals a bank ended with its refresh still in the backlog
+        self.num_refreshes_pulled_in = 0
     
     def cycle(self):
         self.cycle_current += 1
         
-        refresh_interval = self.ctrl.channel.t_spec.speed_entry.nREFI
+        if self.b_ref_rank is True:
+            if self.cycle_current - self.cycle_last_refreshed >= self.refresh_interval:
+                self._inject_refresh(True)
+            return
+        
+        if self.cycle_current - self.cycle_last_refreshed >= self.refresh_interval:
+            self._add_bank_refresh_backlog()
+        self._inject_refresh(False)
+    
+    def get_next_event_cycle(self):
+        if self.b_ref_rank is True:
+            return self.cycle_last_refreshed + self.refresh_interval
         
-        if self.cycle_current - self.cycle_last_refreshed >= refresh_interval:
-            self._inject_refresh(True)
+        cycle_next = self.cycle_last_refreshed + self.refresh_interval
+        # a rank may pull in a refresh again one interval after the last one
+        for cycle_last_pulled_in in self._cycle_last_pulled_in:
+            if cycle_last_pulled_in + self.refresh_interval > self.cycle_current:
+                cycle_next = min(cycle_next, cycle_last_pulled_in + self.refresh_interval)
+        # a refresh of the backlog may be injected once its first command is ready
+        for _, _, cmd, addr_list in self._get_bank_refresh_candidates():
+            cycle_next = min(cycle_next, self.ctrl.channel.get_next_ready_cycle(cmd, addr_list))
+        return cycle_next
+    
+    def skip_cycles(self, num_cycles):
+        self.cycle_current += num_cycles
     
     def _inject_refresh(self, b_ref_rank: bool):
         if b_ref_rank is True:  # Rank-level refresh
+            # a rank in self-refresh refreshes itself
             for rank in self.ctrl.channel.children:
+                if rank.get_state() == strings.state_selfrefresh:
+                    continue
                 self._refresh_target(self.ctrl, rank.id_, -1, -1)
+                self.num_refreshes += 1
+            self.cycle_last_refreshed = self.cycle_current
         else:  # Bank-level refresh
-            # Simultaneously issue to all ranks
-            for rank in self.ctrl.channel.children:
-                self._refresh_target(self.ctrl, rank.id_, self.bank_ref_counters[rank.id_], -1)
+            # the most urgent refresh of the backlog that is ready, one per cycle
+            if self.ctrl.queue_other.size() >= self.ctrl.queue_other.max:
+                return
+            for rank_id, bank, cmd, addr_list in self._get_bank_refresh_candidates():
+                if not self.ctrl.is_ready_cmd(cmd, addr_list):
+                    continue
+                backlog = self.__bank_refresh_backlog[rank_id]
+                if backlog[bank] <= 0:
+                    self.num_refreshes_pulled_in += 1
+                    self._cycle_last_pulled_in[rank_id] = self.cycle_current
+                elif backlog[bank] == 1:
+                    self._num_banks_due -= 1
+                backlog[bank] -= 1
+                self._refresh_target(self.ctrl, rank_id, bank // self.cnt_max_bank_bg, bank % self.cnt_max_bank_bg)
+                self.num_refreshes += 1
+                return
+    
+    def _add_bank_refresh_backlog(self):
+        # the next bank of every rank is due for a refresh
+        for rank in self.ctrl.channel.children:
+            if rank.get_state() == strings.state_selfrefresh:
+                continue
+            backlog = self.__bank_refresh_backlog[rank.id_]
+            bank = self.bank_ref_counters[rank.id_]
+            if backlog[bank] > 0:
+                self.num_refreshes_postponed += 1
+            elif backlog[bank] == 0:
+                self._num_banks_due += 1
+            backlog[bank] += 1
+            self.bank_ref_counters[rank.id_] = (bank + 1) % self.cnt_max_bank
         self.cycle_last_refreshed = self.cycle_current
     
+    def _get_bank_refresh_candidates(self):
+        # the refreshes that may be injected, as (rank, bank, first command, address
+        # list), the most urgent first: those of a full backlog, those due without
+        # queued row hits to postpone them, and those pulled in while idle
+        ctrl = self.ctrl
+        is_idle = ctrl.queue_read.size() == 0 and ctrl.queue_write.size() == 0 and ctrl.queue_activate.size() == 0
+        if self._num_banks_due == 0 and is_idle is False:
+            return []
+        candidates = []
+        for rank in ctrl.channel.children:
+            rank_state = rank.get_state()
+            if rank_state == strings.state_selfrefresh:
+                continue
+            backlog = self.__bank_refresh_backlog[rank.id_]
+            is_pull_in = is_idle and rank_state == strings.state_powerup and \
+                self.cycle_current - self._cycle_last_pulled_in[rank.id_] >= self.refresh_interval
+            addr_lists = self._bank_addr_lists[rank.id_]
+            for bank in range(self.cnt_max_bank):
+                if backlog[bank] >= self.__backlog_max:
+                    urgency = 0
+                elif backlog[bank] > 0:
+                    urgency = 1
+                elif is_pull_in and backlog[bank] > self._backlog_pull_in_min:
+                    urgency = 2
+                else:
+                    continue
+                addr_list = addr_lists[bank]
+                bank_group = addr_list[:self.level_bank + 1]
+                if len(ctrl.queue_other.get_bank(bank_group)) > 0:
+                    continue  # already queued
+                if urgency == 1 and self._has_row_hits(bank_group):
+                    continue
+                cmd = ctrl.channel.decode(self._cmd_refsb, addr_list)
+                candidates.append((urgency, -backlog[bank], rank.id_, bank, cmd, addr_list))
+        candidates.sort(key=lambda candidate: candidate[:4])
+        return [candidate[2:] for candidate in candidates]
+    
+    def _has_row_hits(self, bank_group):
+        for queue in [self.ctrl.queue_activate, self.ctrl.queue_read, self.ctrl.queue_write]:
+            for req in queue.get_bank(bank_group):
+                if self.ctrl.is_row_hit_req(req):
+                    return True
+        return False
+    
     @staticmethod
-    def _refresh_target(ctrl: Controller, rank: int, bank: int, sa: int):
+    def _get_addr_list(ctrl: Controller, rank: int, bankgroup: int, bank: int):
         addr_list = [-1 for _ in range(len(Refresh.t_spec.level))]
         addr_list[0] = ctrl.channel.id_
         addr_list[1] = rank
-        addr_list[2] = bank
-        addr_list[3] = sa
-        
-        req = Request(addr_list, Request.Type.refresh, None)
+        addr_list[2] = bankgroup
+        addr_list[3] = bank
+        return addr_list
+    
+    @staticmethod
+    def _refresh_target(ctrl: Controller, rank: int, bankgroup: int, bank: int):
+        addr_list = Refresh._get_addr_list(ctrl, rank, bankgroup, bank)
+        type_ = Request.Type.refresh if bankgroup < 0 else Request.Type.refresh_bank
+        req = Request(addr_list, type_, None)
         res = ctrl.enqueue(req)
         assert res is True
@@ -1,3 +1,4 @@
 from .scheduler import Scheduler
 from .row_table import RowTable
 from .row_policy import RowPolicy
+from .power_policy import PowerPolicy
@@ -0,0 +1,101 @@
+from configs import strings
+
+
+class PowerPolicy(object):
+    from offchip.controller import Controller
+    
+    # Idle-timeout power management: a rank without queued requests enters
+    # power-down after powerdown_timeout cycles without a read or write command,
+    # and self-refresh after selfrefresh_timeout cycles (0 disables either). The
+    # requests wake the rank on demand, as their first command is then PDX or SRX.
+    def __init__(self, ctrl):
+        from offchip.standard import BaseSpec as t_spec
+        self.ctrl = ctrl  # type: PowerPolicy.Controller
+        args = ctrl.channel.args
+        self.powerdown_timeout = args.powerdown_timeout
+        self.selfrefresh_timeout = args.selfrefresh_timeout
+        self.enabled = self.powerdown_timeout > 0 or self.selfrefresh_timeout > 0
+        
+        self._cmds_access = {t_spec.cmd.act, t_spec.cmd.rd, t_spec.cmd.wr, t_spec.cmd.rda, t_spec.cmd.wra}
+        self._cmd_pde = t_spec.cmd.pde
+        self._cmd_sre = t_spec.cmd.sre
+        self._level_rank = t_spec.level.rank.value
+        self._len_addr = len(t_spec.level)
+        # the last cycle a rank was accessed on behalf of a request
+        self.cycle_last_access = [0 for _ in ctrl.channel.children]
+        
+        # statistics
+        self.num_powerdowns = 0
+        self.num_selfrefreshes = 0
+    
+    def update(self, cmd, addr_list, cycle_curr):
+        if cmd in self._cmds_access:
+            self.cycle_last_access[addr_list[self._level_rank]] = cycle_curr
+        elif cmd == self._cmd_pde:
+            self.num_powerdowns += 1
+        elif cmd == self._cmd_sre:
+            self.num_selfrefreshes += 1
+    
+    def get_cmd(self):
+        # a power management command that is ready to be issued, as (cmd, addr_list), or None
+        if self.enabled is False:
+            return None
+        for rank in self.ctrl.channel.children:
+            # the deepest state whose timeout is over
+            targets = [target for target in self._get_targets(rank) if target[0] <= self.ctrl.cycle_curr]
+            if len(targets) == 0 or self._has_requests(rank.id_):
+                continue
+            cmd_addr = self._decode(targets[-1][1], rank)
+            if self.ctrl.is_ready_cmd(*cmd_addr):
+                return cmd_addr
+        return None
+    
+    def get_next_event_cycle(self):
+        # the earliest cycle at which get_cmd may return a command, None if never
+        if self.enabled is False:
+            return None
+        cycle_next = None
+        for rank in self.ctrl.channel.children:
+            targets = self._get_targets(rank)
+            if len(targets) == 0 or self._has_requests(rank.id_):
+                continue
+            # the target get_cmd chooses, the deepest whose timeout is over or
+            # else the next one, until the timeout of a deeper one replaces it
+            index = max(sum(1 for target in targets if target[0] <= self.ctrl.cycle_curr) - 1, 0)
+            cycle_timeout, cmd_target = targets[index]
+            cmd, addr_list = self._decode(cmd_target, rank)
+            cycle_ready = max(self.ctrl.channel.get_next_ready_cycle(cmd, addr_list), cycle_timeout)
+            if index + 1 < len(targets):
+                cycle_ready = min(cycle_ready, targets[index + 1][0])
+            if cycle_next is None or cycle_ready < cycle_next:
+                cycle_next = cycle_ready
+        return cycle_next
+    
+    def _get_targets(self, rank):
+        # the power states a rank may enter, as (cycle of the timeout, command), by timeout
+        state = rank.get_state()
+        if state == strings.state_selfrefresh:
+            return []
+        cycle_last_access = self.cycle_last_access[rank.id_]
+        targets = []
+        if self.powerdown_timeout > 0 and state == strings.state_powerup:
+            targets.append((cycle_last_access + self.powerdown_timeout, self._cmd_pde))
+        if self.selfrefresh_timeout > 0:
+            targets.append((cycle_last_access + self.selfrefresh_timeout, self._cmd_sre))
+        targets.sort(key=lambda target: target[0])
+        return targets
+    
+    def _decode(self, cmd, rank):
+        # the next command toward cmd for the rank (e.g., PDX before SRE from power-down)
+        addr_list = [-1 for _ in range(self._len_addr)]
+        addr_list[0] = self.ctrl.channel.id_
+        addr_list[self._level_rank] = rank.id_
+        return self.ctrl.channel.decode(cmd, addr_list), addr_list
+    
+    def _has_requests(self, rank_id):
+        # a rank is idle only while no request to it is queued, refreshes included
+        for queue in [self.ctrl.queue_activate, self.ctrl.queue_read, self.ctrl.queue_write, self.ctrl.queue_other]:
+            for req in queue.queue_req:
+                if req.addr_list[self._level_rank] == rank_id:
+                    return True
+        return False
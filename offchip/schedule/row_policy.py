@@ -1,5 +1,6 @@
 from typing import List
 from enum import Enum, unique
+from configs import strings
 
 
 class RowPolicy(object):
@@ -15,8 +16,11 @@ class RowPolicy(object):
     
     def __init__(self, ctrl):
         self.ctrl = ctrl  # type: RowPolicy.Controller
-        self.type = self.Type.opened
-        self.timeout = 50
+        args = ctrl.channel.args
+        self.type = self.Type[args.row_policy]
+        self.timeout = args.timeout
+        # only power-down leaves rows open, self-refresh precharges them first
+        self._powerdown = args.powerdown_timeout > 0
         
         self._policy = {
             self.Type.closed: self._policy_closed,
@@ -28,17 +32,50 @@ class RowPolicy(object):
     def get_victim(self, cmd):
         return self._policy[self.type](cmd)
     
+    def get_next_event_cycle(self, cmd):
+        # the earliest cycle at which get_victim may return a victim, None if never
+        if self.type == self.Type.opened:
+            return None
+        
+        cycle_next = None
+        for k, v in self.ctrl.row_table.table.items():
+            if not self._is_powerup(k):
+                continue
+            cycle_ready = self.ctrl.channel.get_next_ready_cycle(cmd, self._get_addr_list(k))
+            if self.type == self.Type.timeout:
+                cycle_ready = max(cycle_ready, v.timestamp + self.timeout)
+            if cycle_next is None or cycle_ready < cycle_next:
+                cycle_next = cycle_ready
+        return cycle_next
+    
+    def _get_addr_list(self, row_group):
+        # row table keys stop above the row level, pad them to a full address
+        return list(row_group) + [-1] * (len(self.ctrl.t_spec.level) - len(row_group))
+    
+    def _is_powerup(self, row_group):
+        # the rows of a rank in power-down stay open until it wakes up
+        if self._powerdown is False:
+            return True
+        return self.ctrl.channel.children[row_group[self.ctrl.t_spec.level.rank.value]].get_state() == \
+            strings.state_powerup
+    
     def _policy_closed(self, cmd):
         for k in self.ctrl.row_table.table.keys():
+            k = self._get_addr_list(k)
             if not self.ctrl.is_ready_cmd(cmd, k):
                 continue
+            if not self._is_powerup(k):
+                continue
             return k
         return list()
     
     def _policy_closedAP(self, cmd):
         for k in self.ctrl.row_table.table.keys():
+            k = self._get_addr_list(k)
             if not self.ctrl.is_ready_cmd(cmd, k):
                 continue
+            if not self._is_powerup(k):
+                continue
             return k
         return list()
     
@@ -49,7 +86,10 @@ class RowPolicy(object):
         for k, v in self.ctrl.row_table.table.items():
             if self.ctrl.cycle_curr - v.timestamp < self.timeout:
                 continue
+            k = self._get_addr_list(k)
             if not self.ctrl.is_ready_cmd(cmd, k):
                 continue
+            if not self._is_powerup(k):
+                continue
             return k
         return list()
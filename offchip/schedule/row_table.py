@@ -37,16 +37,15 @@ class RowTable(object):
             if spec.is_accessing(cmd) is True:
                 scope = self.t_spec.level.row.value - 1
             else:
-                scope = spec.scope[cmd.value]
+                scope = spec.scope[cmd.value].value
             table_keys = list(self.table.keys())
             for key in table_keys:
-                if key[:(scope.value + 1)] == tuple(addr_list[:(scope.value + 1)]):
+                if key[:(scope + 1)] == tuple(addr_list[:(scope + 1)]):
                     n_rm += 1
                     del self.table[key]
+            # PREA closes every opened row of the rank, so more than one entry may go
             if n_rm <= 0:
                 raise Exception(n_rm)
-            elif n_rm != 1:
-                raise Exception(n_rm)
     
     def get_hits(self, addr_list, to_opened_row=False):
         row_group = tuple(addr_list[:self.t_spec.level.row.value])
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, Iterable
 from enum import Enum, unique
 from offchip.data_structure import Request
 
@@ -14,108 +14,98 @@ class Scheduler(object):
         FRFCFS_CAP = 2
         FRFCFS_PriorHit = 3
     
+    # indices of the memoized state of a request
+    _ready = 0
+    _prior = 1
+    _row_hit = 2
+    
     def __init__(self, controller):
         self.ctrl = controller  # type: Scheduler.Controller
-        # Change the following line to change scheduling policy
-        self.type = Scheduler.Type.FRFCFS_CAP  # type: Scheduler.Type
-        # Change the following line to change cap
-        self.cap = 16
+        args = controller.channel.args
+        self.type = Scheduler.Type[args.scheduler]  # type: Scheduler.Type
+        self.cap = args.cap
         
-        self._compare = {
-            self.Type.FCFS: self._compare_FCFS,
-            self.Type.FRFCFS: self._compare_FRFCFS,
-            self.Type.FRFCFS_CAP: self._compare_FRFCFS_CAP,
-            self.Type.FRFCFS_PriorHit: self._compare_FRFCFS_PriorHit
-        }  # type: List[Scheduler._compare_FCFS]
+        # The state of every queued request, computed at most once between two
+        # changes of the DRAM state: a new cycle or an issued command.
+        self._memo = {}  # type: Dict[Request, list]
+        self._memo_key = None
     
-    def get_head(self, queue_req: List[Request]):
+    def get_head(self, queue_req: Iterable[Request]):
         
         # If queue is empty, return end of queue
         if len(queue_req) == 0:
             return None
         
         # Else return based on the policy
-        head = queue_req[0]
-        for i in range(1, len(queue_req)):
-            head = self._compare[self.type](head, queue_req[i])
+        if len(queue_req) == 1 and self.type != self.Type.FRFCFS_PriorHit:
+            # nothing to compare with
+            return next(iter(queue_req))
+        elif self.type == self.Type.FCFS:
+            # the first of the oldest requests
+            return min(queue_req, key=self._get_arrive)
+        
+        # The first of the oldest requests among the prioritized ones (ready, below
+        # the cap or ready row hits) if any, else among all of them. This is what
+        # folding the pairwise comparison over the queue selects.
+        head = None
+        head_prior = False
+        for req in queue_req:
+            prior = self._get_state(req)[self._prior]
+            if head is None or (prior and not head_prior) or \
+                    (prior == head_prior and req.cycle_arrive < head.cycle_arrive):
+                head = req
+                head_prior = prior
         
         if self.type != self.Type.FRFCFS_PriorHit:
             return head
-        elif self.ctrl.is_ready_req(head) and self.ctrl.is_row_hit_req(head):
+        elif head_prior is True:
             return head
         
-        hit_reqs = []
+        # do not open another row of a bank that still has row hits pending
+        scope = self.ctrl.channel.t_spec.scope[self.t_spec.cmd.pre.value].value
+        hit_row_groups = set()
         for req in queue_req:
-            if self.ctrl.is_row_hit_req(req):
-                begin = 0
-                end = begin + self.ctrl.channel.t_spec.scope[self.t_spec.cmd.pre.value] + 1
-                hit_reqs.append([begin, end])
+            if self._get_state(req)[self._row_hit]:
+                hit_row_groups.add(tuple(req.addr_list[:scope + 1]))
         
         # if we can't find proper request, we need to return q.end(),
         # so that no command will be scheduled
         head = None
+        head_ready = False
         for req in queue_req:
-            violate_hit = False
-            if self.ctrl.is_row_hit_req(req) is False and self.ctrl.is_row_open_req(req):
-                begin = 0
-                end = begin + self.ctrl.channel.t_spec.scope[self.t_spec.cmd.pre.value] + 1
-                for hit_req_rowgroup in hit_reqs:
-                    if hit_req_rowgroup == [begin, end]:
-                        violate_hit = True
-                        break
-            if violate_hit is True:
-                continue
+            state = self._get_state(req)
+            if state[self._row_hit] is False and self.ctrl.is_row_open_req(req):
+                if tuple(req.addr_list[:scope + 1]) in hit_row_groups:
+                    continue
             
             # If it comes here, that means it won't violate any hit request
-            if head is None:
+            ready = state[self._ready]
+            if head is None or (ready and not head_ready) or \
+                    (ready == head_ready and req.cycle_arrive < head.cycle_arrive):
                 head = req
-            else:
-                head = self._compare[Scheduler.Type.FRFCFS](head, req)
+                head_ready = ready
         return head
     
-    def _compare_FCFS(self, req1: Request, req2: Request):
-        if req1.cycle_arrive <= req2.cycle_arrive:
-            return req1
-        return req2
-    
-    def _compare_FRFCFS(self, req1: Request, req2: Request):
-        ready1 = self.ctrl.is_ready_req(req1)
-        ready2 = self.ctrl.is_ready_req(req2)
-        
-        if ready1 ^ ready2:
-            if ready1:
-                return req1
-            return req2
+    def _get_state(self, req: Request):
+        key = (self.ctrl.cycle_curr, self.ctrl.num_cmds_issued)
+        if key != self._memo_key:
+            self._memo = {}
+            self._memo_key = key
         
-        if req1.cycle_arrive <= req2.cycle_arrive:
-            return req1
-        return req2
-    
-    def _compare_FRFCFS_CAP(self, req1: Request, req2: Request):
-        ready1 = self.ctrl.is_ready_req(req1)
-        ready2 = self.ctrl.is_ready_req(req2)
-        
-        ready1 = ready1 and (self.ctrl.row_table.get_hits(req1.addr_list) < self.cap)
-        ready2 = ready2 and (self.ctrl.row_table.get_hits(req2.addr_list) < self.cap)
-        
-        if ready1 ^ ready2:
-            if ready1:
-                return req1
-            return req2
-        
-        if req1.cycle_arrive <= req2.cycle_arrive:
-            return req1
-        return req2
+        state = self._memo.get(req)
+        if state is None:
+            ready = self.ctrl.is_ready_req(req)
+            row_hit = None
+            if self.type == self.Type.FRFCFS_CAP:
+                prior = ready and (self.ctrl.row_table.get_hits(req.addr_list) < self.cap)
+            elif self.type == self.Type.FRFCFS_PriorHit:
+                row_hit = self.ctrl.is_row_hit_req(req)
+                prior = ready and row_hit
+            else:
+                prior = ready
+            state = self._memo[req] = [ready, prior, row_hit]
+        return state
     
-    def _compare_FRFCFS_PriorHit(self, req1: Request, req2: Request):
-        ready1 = self.ctrl.is_ready_req(req1) and self.ctrl.is_row_hit_req(req1)
-        ready2 = self.ctrl.is_ready_req(req2) and self.ctrl.is_row_hit_req(req2)
-        
-        if ready1 ^ ready2:
-            if ready1:
-                return req1
-            return req2
-        
-        if req1.cycle_arrive <= req2.cycle_arrive:
-            return req1
-        return req2
+    @staticmethod
+    def _get_arrive(req: Request):
+        return req.cycle_arrive
@@ -0,0 +1,77 @@
+from collections import deque
+from typing import Deque
+from offchip.data_structure import Request
+
+
+class Simulator(object):
+    # The memory as a backend of a host simulator (e.g., a CPU or accelerator
+    # model) in the same process. The host sends requests with send(), advances
+    # the memory with tick() or run_until(), and receives every completed
+    # request through its callback or, if it has none, through completions().
+    from offchip.memory import Memory
+    
+    def __init__(self, args_, spec_=None, channels=None):
+        from offchip.standard import get_spec
+        from offchip.controller import Controller
+        from offchip.dram_module import DRAM
+        from offchip.memory import Memory
+        if spec_ is None:
+            spec_ = get_spec(args_)
+        if channels is None:
+            channels = range(args_.num_channels)
+        self.args = args_
+        self.spec = spec_
+        
+        ctrls = []
+        for i in channels:
+            channel = DRAM(spec_, args_, spec_.level.channel, i)
+            ctrls.append(Controller(spec_, channel))
+        self.memory = Memory(args_, ctrls)  # type: Simulator.Memory
+        
+        self._completed = deque()  # type: Deque[Request]
+        self._dict_type = {'read': Request.Type.read,
+                           'write': Request.Type.write}
+    
+    def send(self, addr, type_='read', device='', callback=None):
+        # Enqueue a read or write to addr (an int, or an address list that is
+        # already decoded) in the current cycle. The request is returned, or None
+        # if its queue is full, in which case the host retries after a tick.
+        if type_ in self._dict_type:
+            type_ = self._dict_type[type_]
+        if callback is None:
+            callback = self._completed.append
+        request = Request(addr, type_, device, callback)
+        self.memory.send(request)
+        if self.memory.flag_stall is True:
+            return None
+        return request
+    
+    def tick(self, num_cycles=1):
+        # advance the memory by num_cycles cycles and return the requests
+        # completed in them (the ones with a callback included)
+        return self.memory.run(num_cycles)
+    
+    def run_until(self, num_cycle):
+        # advance the memory to the cycle num_cycle
+        return self.tick(num_cycle - self.memory.get_num_cycle())
+    
+    def completions(self):
+        # the completed requests without a callback, in the order of their completion
+        completed = self._completed
+        while len(completed) > 0:
+            yield completed.popleft()
+    
+    def get_num_cycle(self):
+        return self.memory.get_num_cycle()
+    
+    def get_num_pending_requests(self):
+        return self.memory.get_num_pending_requests()
+    
+    def drain(self):
+        # serve every queued request, the writes included
+        self.memory.set_high_writeq_watermark(0.0)
+        while self.memory.get_num_pending_requests() > 0:
+            self.run_until(self.memory.get_next_event_cycle())
+    
+    def finish(self):
+        self.memory.finish()
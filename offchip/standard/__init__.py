@@ -1 +1,10 @@
+from configs import strings
 from offchip.standard.spec_base import BaseSpec
+
+
+def get_spec(args_):
+    # a new spec of the standard named by the arguments
+    if args_.name_spec == strings.standard.hbm:
+        return BaseSpec(args_)
+    else:
+        raise Exception(args_.name_spec)
@@ -1,3 +1,4 @@
+import copy
 from typing import Dict, List
 from offchip.standard.spec_data_structure import TimingEntry
 from configs import strings
@@ -33,15 +34,11 @@ class Level(Enum):
 
 
 class BaseSpec(object):
-    from main import Global
     cmd = Command
     level = Level
     
     name_spec = strings.standard.hbm
     
-    # ._num_ranks = args.num_ranks
-    # ._num_channels = args.num_channels
-    
     start = {Level.channel: None,
              Level.rank: strings.state_powerup,
              Level.bankgroup: None,
@@ -49,25 +46,18 @@ class BaseSpec(object):
              Level.row: strings.state_closed,
              Level.column: None}
     
-    prereq = {l: {c: None for c in Command} for l in Level}
-    rowhit = {l: {c: None for c in Command} for l in Level}
-    rowopen = {l: {c: None for c in Command} for l in Level}
-    lambda_ = {l: {c: None for c in Command} for l in Level}
-    timing = {l: {c: [] for c in Command} for l in Level
-              }  # type: Dict[str,Dict[str,List[TimingEntry]]]
-    
     from offchip.standard.spec_data_structure import OrgEntry
     org_table = {strings.org_1Gb: OrgEntry(1 << 10, 128, [0, 0, 4, 2, 1 << 13, 1 << (6 + 1)]),
                  strings.org_2Gb: OrgEntry(2 << 10, 128, [0, 0, 4, 2, 1 << 14, 1 << (6 + 1)]),
                  strings.org_4Gb: OrgEntry(4 << 10, 128, [0, 0, 4, 4, 1 << 14, 1 << (6 + 1)])}
-    org_entry = org_table[Global.args.org]  # type:OrgEntry
-    org_entry.count[Level.rank.value] = Global.args.num_ranks
-    org_entry.count[Level.channel.value] = Global.args.num_channels
     
     from offchip.standard.spec_data_structure import SpeedEntry
     speed_table = {strings.speed_1Gbps: SpeedEntry(1000, 500, 2.0, 2, 2, 3, 7, 7, 6, 7, 4, 17, 24, 7, 2, 4, 8, 4, 5, 20, 0, 1950, 0, 5, 5, 5, 0)}
-    speed_entry = speed_table[Global.args.speed]
-    read_latency = speed_entry.nCL + speed_entry.nBL
+    
+    # placeholder currents of an HBM channel, not those of a datasheet, so the
+    # energy is uncalibrated and only compares runs with each other
+    from offchip.standard.spec_data_structure import PowerEntry
+    power_table = {strings.speed_1Gbps: PowerEntry(1.2, 65, 28, 40, 38, 55, 390, 330, 250, 31)}
     
     prefetch_size = 4  # burst length could be 2 and 4 (choose 4 here), 2n prefetch
     channel_width = 128
@@ -82,19 +72,38 @@ class BaseSpec(object):
     translate = {Request.Type.read: Command.rd,
                  Request.Type.write: Command.wr,
                  Request.Type.refresh: Command.ref,
+                 Request.Type.refresh_bank: Command.refsb,
                  Request.Type.powerdown: Command.pde,
                  Request.Type.selfrefresh: Command.sre}
     
-    @staticmethod
-    def initialize():
-        assert BaseSpec.Global.args.name_spec == BaseSpec.name_spec
-        
-        BaseSpec._init_speed()
-        BaseSpec._init_prereq()
-        BaseSpec._init_rowhit()
-        BaseSpec._init_rowopen()
-        BaseSpec._init_lambda()
-        BaseSpec._init_timing()
+    def __init__(self, args):
+        # The org, the speed and the tables built from them belong to the
+        # instance, so that specs of different arguments can live side by side.
+        from offchip.standard.spec_data_structure import OrgEntry
+        assert args.name_spec == self.name_spec
+        
+        self.prereq = {l: {c: None for c in Command} for l in Level}
+        self.rowhit = {l: {c: None for c in Command} for l in Level}
+        self.rowopen = {l: {c: None for c in Command} for l in Level}
+        self.lambda_ = {l: {c: None for c in Command} for l in Level}
+        self.timing = {l: {c: [] for c in Command} for l in Level
+                       }  # type: Dict[str,Dict[str,List[TimingEntry]]]
+        
+        org_entry = self.org_table[args.org]
+        self.org_entry = OrgEntry(org_entry.size, org_entry.dq, list(org_entry.count))  # type:OrgEntry
+        self.org_entry.count[Level.rank.value] = args.num_ranks
+        self.org_entry.count[Level.channel.value] = args.num_channels
+        
+        self.speed_entry = copy.copy(self.speed_table[args.speed])
+        self.power_entry = copy.copy(self.power_table[args.speed])
+        self.read_latency = self.speed_entry.nCL + self.speed_entry.nBL
+        
+        self._init_speed()
+        self._init_prereq()
+        self._init_rowhit()
+        self._init_rowopen()
+        self._init_lambda()
+        self._init_timing()
     
     @staticmethod
     def is_opening(cmd):
@@ -127,31 +136,29 @@ class BaseSpec(object):
             return True
         return False
     
-    @staticmethod
-    def _init_speed():
+    def _init_speed(self):
         RFC_TABLE = [55, 80, 130]
         REFI1B_TABLE = [64, 128, 256]
         XS_TABLE = [60, 85, 135]
         
-        if BaseSpec.speed_entry.rate == 1000:
+        if self.speed_entry.rate == 1000:
             speed = 0
         else:
-            raise Exception(BaseSpec.speed_entry.rate)
-        if BaseSpec.org_entry.size >> 10 == 1:
+            raise Exception(self.speed_entry.rate)
+        if self.org_entry.size >> 10 == 1:
             density = 0
-        elif BaseSpec.org_entry.size >> 10 == 2:
+        elif self.org_entry.size >> 10 == 2:
             density = 1
-        elif BaseSpec.org_entry.size >> 10 == 4:
+        elif self.org_entry.size >> 10 == 4:
             density = 2
         else:
-            raise Exception(BaseSpec.org_entry.size)
-        len_speed = len(BaseSpec.speed_table)
-        BaseSpec.speed_entry.nRFC = RFC_TABLE[speed * len_speed + density]
-        BaseSpec.speed_entry.nREFI1B = REFI1B_TABLE[speed * len_speed + density]
-        BaseSpec.speed_entry.nXS = XS_TABLE[speed * len_speed + density]
+            raise Exception(self.org_entry.size)
+        len_speed = len(self.speed_table)
+        self.speed_entry.nRFC = RFC_TABLE[speed * len_speed + density]
+        self.speed_entry.nREFI1B = REFI1B_TABLE[speed * len_speed + density]
+        self.speed_entry.nXS = XS_TABLE[speed * len_speed + density]
     
-    @staticmethod
-    def _init_prereq():
+    def _init_prereq(self):
         from offchip.dram_module import DRAM
         
         def prereq_rank_rd(node: DRAM, cmd, id_):
@@ -179,6 +186,11 @@ class BaseSpec(object):
                 raise Exception(node_state)
         
         def prereq_rank_ref(node: DRAM, cmd, id_):
+            node_state = node.get_state()
+            if node_state in [strings.state_actpowerdown, strings.state_prepowerdown]:
+                return BaseSpec.cmd.pdx
+            elif node_state == strings.state_selfrefresh:
+                return BaseSpec.cmd.srx
             for bg in node.children:
                 for bank in bg.children:
                     if bank.get_state() == strings.state_closed:
@@ -186,6 +198,14 @@ class BaseSpec(object):
                     return BaseSpec.cmd.prea
             return BaseSpec.cmd.ref
         
+        def prereq_rank_refsb(node: DRAM, cmd, id_):
+            node_state = node.get_state()
+            if node_state in [strings.state_actpowerdown, strings.state_prepowerdown]:
+                return BaseSpec.cmd.pdx
+            elif node_state == strings.state_selfrefresh:
+                return BaseSpec.cmd.srx
+            return None
+        
         def prereq_bank_refsb(node: DRAM, cmd, id_):
             if node.get_state() == strings.state_closed:
                 return BaseSpec.cmd.refsb
@@ -207,28 +227,33 @@ class BaseSpec(object):
         def prereq_rank_sre(node: DRAM, cmd, id_):
             node_state = node.get_state()
             if node_state == strings.state_powerup:
+                # all banks have to be precharged
+                for bg in node.children:
+                    for bank in bg.children:
+                        if bank.get_state() != strings.state_closed:
+                            return BaseSpec.cmd.prea
                 return BaseSpec.cmd.sre
             elif node_state == strings.state_actpowerdown:
                 return BaseSpec.cmd.pdx
             elif node_state == strings.state_prepowerdown:
-                return BaseSpec.cmd.pde
+                return BaseSpec.cmd.pdx
             elif node_state == strings.state_selfrefresh:
                 return BaseSpec.cmd.sre
             else:
                 raise Exception(node_state)
         
-        BaseSpec.prereq[BaseSpec.level.bank][BaseSpec.cmd.rd] = prereq_bank_rd
-        BaseSpec.prereq[BaseSpec.level.rank][BaseSpec.cmd.rd] = prereq_rank_rd
-        BaseSpec.prereq[BaseSpec.level.bank][BaseSpec.cmd.wr] = prereq_bank_rd
-        BaseSpec.prereq[BaseSpec.level.rank][BaseSpec.cmd.wr] = prereq_rank_rd
+        self.prereq[BaseSpec.level.bank][BaseSpec.cmd.rd] = prereq_bank_rd
+        self.prereq[BaseSpec.level.rank][BaseSpec.cmd.rd] = prereq_rank_rd
+        self.prereq[BaseSpec.level.bank][BaseSpec.cmd.wr] = prereq_bank_rd
+        self.prereq[BaseSpec.level.rank][BaseSpec.cmd.wr] = prereq_rank_rd
         
-        BaseSpec.prereq[BaseSpec.level.rank][BaseSpec.cmd.ref] = prereq_rank_ref
-        BaseSpec.prereq[BaseSpec.level.bank][BaseSpec.cmd.refsb] = prereq_bank_refsb
-        BaseSpec.prereq[BaseSpec.level.rank][BaseSpec.cmd.pde] = prereq_rank_pde
-        BaseSpec.prereq[BaseSpec.level.rank][BaseSpec.cmd.sre] = prereq_rank_sre
+        self.prereq[BaseSpec.level.rank][BaseSpec.cmd.ref] = prereq_rank_ref
+        self.prereq[BaseSpec.level.rank][BaseSpec.cmd.refsb] = prereq_rank_refsb
+        self.prereq[BaseSpec.level.bank][BaseSpec.cmd.refsb] = prereq_bank_refsb
+        self.prereq[BaseSpec.level.rank][BaseSpec.cmd.pde] = prereq_rank_pde
+        self.prereq[BaseSpec.level.rank][BaseSpec.cmd.sre] = prereq_rank_sre
     
-    @staticmethod
-    def _init_rowhit():
+    def _init_rowhit(self):
         from offchip.dram_module import DRAM
         
         def rowhit(node: DRAM, cmd, id_):
@@ -242,11 +267,10 @@ class BaseSpec(object):
             else:
                 raise Exception(node_state)
         
-        BaseSpec.rowhit[BaseSpec.level.bank][BaseSpec.cmd.rd] = rowhit
-        BaseSpec.rowhit[BaseSpec.level.bank][BaseSpec.cmd.wr] = rowhit
+        self.rowhit[BaseSpec.level.bank][BaseSpec.cmd.rd] = rowhit
+        self.rowhit[BaseSpec.level.bank][BaseSpec.cmd.wr] = rowhit
     
-    @staticmethod
-    def _init_rowopen():
+    def _init_rowopen(self):
         from offchip.dram_module import DRAM
         
         def rowopen(node: DRAM, cmd, id_):
@@ -258,11 +282,10 @@ class BaseSpec(object):
             else:
                 raise Exception(node_state)
         
-        BaseSpec.rowopen[BaseSpec.level.bank][BaseSpec.cmd.rd] = rowopen
-        BaseSpec.rowopen[BaseSpec.level.bank][BaseSpec.cmd.wr] = rowopen
+        self.rowopen[BaseSpec.level.bank][BaseSpec.cmd.rd] = rowopen
+        self.rowopen[BaseSpec.level.bank][BaseSpec.cmd.wr] = rowopen
     
-    @staticmethod
-    def _init_lambda():
+    def _init_lambda(self):
         from offchip.dram_module import DRAM
         
         def lambda_bank_act(node: DRAM, id_):
@@ -314,24 +337,23 @@ class BaseSpec(object):
         def lambda_rank_srx(node: DRAM, id_):
             node.set_state(strings.state_powerup)
         
-        BaseSpec.lambda_[BaseSpec.level.bank][BaseSpec.cmd.act] = lambda_bank_act
-        BaseSpec.lambda_[BaseSpec.level.bank][BaseSpec.cmd.pre] = lambda_bank_pre
-        BaseSpec.lambda_[BaseSpec.level.rank][BaseSpec.cmd.prea] = lambda_rank_prea
-        BaseSpec.lambda_[BaseSpec.level.rank][BaseSpec.cmd.ref] = lambda_rank_ref
-        BaseSpec.lambda_[BaseSpec.level.bank][BaseSpec.cmd.rd] = lambda_bank_rd
-        BaseSpec.lambda_[BaseSpec.level.bank][BaseSpec.cmd.wr] = lambda_bank_wr
-        BaseSpec.lambda_[BaseSpec.level.bank][BaseSpec.cmd.rda] = lambda_bank_rda
-        BaseSpec.lambda_[BaseSpec.level.bank][BaseSpec.cmd.wra] = lambda_bank_wra
-        BaseSpec.lambda_[BaseSpec.level.rank][BaseSpec.cmd.pde] = lambda_rank_pde
-        BaseSpec.lambda_[BaseSpec.level.rank][BaseSpec.cmd.pdx] = lambda_rank_pdx
-        BaseSpec.lambda_[BaseSpec.level.rank][BaseSpec.cmd.sre] = lambda_rank_sre
-        BaseSpec.lambda_[BaseSpec.level.rank][BaseSpec.cmd.srx] = lambda_rank_srx
+        self.lambda_[BaseSpec.level.bank][BaseSpec.cmd.act] = lambda_bank_act
+        self.lambda_[BaseSpec.level.bank][BaseSpec.cmd.pre] = lambda_bank_pre
+        self.lambda_[BaseSpec.level.rank][BaseSpec.cmd.prea] = lambda_rank_prea
+        self.lambda_[BaseSpec.level.rank][BaseSpec.cmd.ref] = lambda_rank_ref
+        self.lambda_[BaseSpec.level.bank][BaseSpec.cmd.rd] = lambda_bank_rd
+        self.lambda_[BaseSpec.level.bank][BaseSpec.cmd.wr] = lambda_bank_wr
+        self.lambda_[BaseSpec.level.bank][BaseSpec.cmd.rda] = lambda_bank_rda
+        self.lambda_[BaseSpec.level.bank][BaseSpec.cmd.wra] = lambda_bank_wra
+        self.lambda_[BaseSpec.level.rank][BaseSpec.cmd.pde] = lambda_rank_pde
+        self.lambda_[BaseSpec.level.rank][BaseSpec.cmd.pdx] = lambda_rank_pdx
+        self.lambda_[BaseSpec.level.rank][BaseSpec.cmd.sre] = lambda_rank_sre
+        self.lambda_[BaseSpec.level.rank][BaseSpec.cmd.srx] = lambda_rank_srx
     
-    @staticmethod
-    def _init_timing():
-        s = BaseSpec.speed_entry
+    def _init_timing(self):
+        s = self.speed_entry
         # Channel
-        t = BaseSpec.timing[BaseSpec.level.channel]
+        t = self.timing[BaseSpec.level.channel]
         
         # CAS <-> CAS
         t[BaseSpec.cmd.rd].append(TimingEntry(BaseSpec.cmd.rd, 1, s.nBL))
@@ -344,7 +366,7 @@ class BaseSpec(object):
         t[BaseSpec.cmd.wra].append(TimingEntry(BaseSpec.cmd.wra, 1, s.nBL))
         
         # Rank
-        t = BaseSpec.timing[BaseSpec.level.rank]
+        t = self.timing[BaseSpec.level.rank]
         
         # CAS <-> CAS
         t[BaseSpec.cmd.rd].append(TimingEntry(BaseSpec.cmd.rd, 1, s.nCCDS))
@@ -407,9 +429,12 @@ class BaseSpec(object):
         # REF <-> PD
         t[BaseSpec.cmd.ref].append(TimingEntry(BaseSpec.cmd.pde, 1, 1))
         t[BaseSpec.cmd.pdx].append(TimingEntry(BaseSpec.cmd.ref, 1, s.nXP))
+        t[BaseSpec.cmd.refsb].append(TimingEntry(BaseSpec.cmd.pde, 1, 1))
+        t[BaseSpec.cmd.pdx].append(TimingEntry(BaseSpec.cmd.refsb, 1, s.nXP))
         
         # REF <-> SR
         t[BaseSpec.cmd.srx].append(TimingEntry(BaseSpec.cmd.ref, 1, s.nXS))
+        t[BaseSpec.cmd.srx].append(TimingEntry(BaseSpec.cmd.refsb, 1, s.nXS))
         
         # PD <-> PD
         t[BaseSpec.cmd.pde].append(TimingEntry(BaseSpec.cmd.pdx, 1, s.nPD))
@@ -424,7 +449,7 @@ class BaseSpec(object):
         t[BaseSpec.cmd.srx].append(TimingEntry(BaseSpec.cmd.sre, 1, s.nXS))
         
         # Bank Group
-        t = BaseSpec.timing[BaseSpec.level.bankgroup]
+        t = self.timing[BaseSpec.level.bankgroup]
         # CAS <-> CAS
         t[BaseSpec.cmd.rd].append(TimingEntry(BaseSpec.cmd.rd, 1, s.nCCDL))
         t[BaseSpec.cmd.rd].append(TimingEntry(BaseSpec.cmd.rda, 1, s.nCCDL))
@@ -447,7 +472,7 @@ class BaseSpec(object):
         t[BaseSpec.cmd.act].append(TimingEntry(BaseSpec.cmd.act, 1, s.nRRDL))
         
         # Bank
-        t = BaseSpec.timing[BaseSpec.level.bank]
+        t = self.timing[BaseSpec.level.bank]
         
         # CAS <-> RAS
         t[BaseSpec.cmd.act].append(TimingEntry(BaseSpec.cmd.rd, 1, s.nRCDR))
@@ -46,6 +46,25 @@ class SpeedEntry(object):
         self.nXS = nXS
 
 
+class PowerEntry(object):
+    # the supply voltage (V) and the IDD currents (mA) of a channel, and whether
+    # they are those of a datasheet, without which the energy is only relative
+    def __init__(self, vdd,
+                 idd0, idd2p, idd2n, idd3p, idd3n,
+                 idd4r, idd4w, idd5b, idd6, calibrated=False):
+        self.calibrated = calibrated
+        self.vdd = vdd
+        self.idd0 = idd0  # one bank activating and precharging
+        self.idd2p = idd2p  # precharge power-down
+        self.idd2n = idd2n  # precharge standby
+        self.idd3p = idd3p  # active power-down
+        self.idd3n = idd3n  # active standby
+        self.idd4r = idd4r  # burst read
+        self.idd4w = idd4w  # burst write
+        self.idd5b = idd5b  # burst refresh
+        self.idd6 = idd6  # self-refresh
+
+
 class TimingEntry(object):
     def __init__(self, cmd, dist, val, sibling=False):
         self.cmd = cmd
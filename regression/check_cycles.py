@@ -0,0 +1,112 @@
+# coding=utf-8
+# Cycle-exactness check: run a fixed corpus of synthetic traces through
+# main.py and compare the number of simulated cycles with the golden values
+# recorded from the reference implementation. A parallel run of every trace
+# must reproduce the cycles and the energy of the serial one.
+# Run from the repository root: python -m regression.check_cycles
+import os
+import re
+import sys
+import json
+import random
+import tempfile
+import subprocess
+from tap import Tap
+
+dirname_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+golden_filename = os.path.join(dirname_root, 'regression', 'golden_cycles.json')
+
+# name: (number of requests, seed)
+corpus = {
+    'random': (2000, 1),
+    'streaming': (2000, 2),
+    'hot_rows': (2000, 3),
+    'write_heavy': (2000, 4),
+    'timed': (2000, 5),  # with arrival cycles, in CPU cycles
+}
+list_modes = [[], ['--skip_idle']]
+# with fewer processes than channels, so that a worker carries several on
+list_modes_parallel = [['--num_processes', '3']]
+
+
+class ArgumentParser(Tap):
+    update: bool = False  # record the current results as the golden values
+
+
+def generate_trace(filename, name, num_requests, seed):
+    rand = random.Random(seed)
+    base = rand.getrandbits(32) & ~0xfff
+    cycle_cpu = 0
+    with open(filename, 'w') as f:
+        for i in range(num_requests):
+            if name == 'streaming':
+                addr = (base + i * 64) & 0xffffffff
+            elif name == 'hot_rows':
+                addr = (base + rand.randrange(0, 1 << 16)) & ~0x3f
+            elif name == 'hot_bank':
+                # the columns of a row of channel 0, mostly in one bank, whose row
+                # hits keep postponing its refreshes
+                addr = ((base & ~0xffff) ^ (rand.choice([0, 0, 0, 1]) << 16)) + (rand.randrange(0, 1 << 7) << 9)
+            else:
+                addr = rand.getrandbits(32) & ~0x3f
+            ratio_write = 0.7 if name == 'write_heavy' else 0.3
+            if name in ['timed', 'sparse']:
+                # bursts of requests separated by idle gaps, in the sparse trace
+                # long enough for the ranks to power down and self-refresh
+                cycle_cpu += rand.choice([0, 0, 0, 10, 200] if name == 'timed' else [0, 0, 0, 2000, 20000])
+                f.write('0x{:08x} {} {}\n'.format(addr, 'W' if rand.random() < ratio_write else 'R', cycle_cpu))
+            else:
+                f.write('0x{:08x} {}\n'.format(addr, 'W' if rand.random() < ratio_write else 'R'))
+
+
+def run_trace(trace_filename, mode):
+    out = subprocess.run([sys.executable, 'main.py', '--trace', trace_filename] + mode,
+                         cwd=dirname_root, capture_output=True, text=True, check=True).stdout
+    return int(re.search(r'#cycle: (\d+)', out).group(1)), float(re.search(r'#energy: ([\d.]+)', out).group(1))
+
+
+def main(args_):
+    golden = {}
+    if os.path.exists(golden_filename):
+        with open(golden_filename, 'r') as f:
+            golden = json.load(f)
+    
+    results = {}
+    energies = {}
+    num_failed = 0
+    with tempfile.TemporaryDirectory() as dirname:
+        for name, (num_requests, seed) in corpus.items():
+            trace_filename = os.path.join(dirname, name + '.trace')
+            generate_trace(trace_filename, name, num_requests, seed)
+            for mode in list_modes:
+                key = ' '.join([name] + mode)
+                results[key], energies[key] = run_trace(trace_filename, mode)
+                # every mode must reproduce the cycles of the reference
+                expected = golden.get(name)
+                if results[key] == expected:
+                    status = 'OK'
+                elif args_.update:
+                    status = 'UPDATED (was {})'.format(expected)
+                else:
+                    status = 'FAIL (expected {})'.format(expected)
+                    num_failed += 1
+                print('{:<30} {:>8}  {}'.format(key, results[key], status))
+            for mode in list_modes_parallel:
+                key = ' '.join([name] + mode)
+                cycles, energy = run_trace(trace_filename, mode)
+                if cycles == results[name] and energy == energies[name]:
+                    status = 'OK'
+                else:
+                    status = 'FAIL (energy {}, serial {} in {} cycles)'.format(energy, energies[name], results[name])
+                    num_failed += 1
+                print('{:<30} {:>8}  {}'.format(key, cycles, status))
+    
+    if args_.update:
+        with open(golden_filename, 'w') as f:
+            json.dump({name: results[name] for name in corpus}, f, indent=4, sort_keys=True)
+            f.write('\n')
+    return 1 if num_failed > 0 else 0
+
+
+if __name__ == '__main__':
+    exit(main(ArgumentParser().parse_args()))
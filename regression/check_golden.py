@@ -0,0 +1,154 @@
+# coding=utf-8
+# Golden-output check: run the corpus of check_cycles under every combination
+# of scheduler and row policy, with and without --skip_idle, and compare the
+# number of cycles, the departure cycle of every request and all statistics
+# with the golden outputs recorded from the reference implementation. The
+# departures are stored as a digest, every statistic as a digest of its values
+# over the channels, ranks and banks, and the counters summed over the channels
+# as they are, so that a failure names them. A statistic that is not in the
+# golden outputs yet is not compared, so adding one leaves the others as they are.
+# The power management and the bank refresh options are run on the traces that
+# exercise them, under the default scheduler and the row policies that leave the
+# banks open and closed.
+# Run from the repository root: python -m regression.check_golden
+import os
+import re
+import json
+import hashlib
+import tempfile
+import contextlib
+import itertools
+import multiprocessing
+from tap import Tap
+from regression.check_cycles import corpus, list_modes, generate_trace
+
+dirname_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+golden_filename = os.path.join(dirname_root, 'regression', 'golden_outputs.json')
+list_schedulers = ['FCFS', 'FRFCFS', 'FRFCFS_CAP', 'FRFCFS_PriorHit']
+list_row_policies = ['closed', 'closedAP', 'opened', 'timeout']
+# name: (number of requests, seed), the traces only run with options
+corpus_options = {
+    'sparse': (400, 6),  # with arrival cycles, idle for up to thousands of cycles
+    'hot_bank': (6000, 7),  # long enough for the row hits to fill the refresh backlog
+}
+# the traces to run with the options
+list_options = [
+    (['timed', 'sparse'], ['--powerdown_timeout', '20']),
+    (['timed', 'sparse'], ['--selfrefresh_timeout', '500']),
+    (['timed', 'sparse'], ['--powerdown_timeout', '20', '--selfrefresh_timeout', '500']),
+    (['timed', 'sparse', 'hot_bank'], ['--refresh_mode', 'bank']),
+    (['timed', 'sparse'], ['--refresh_mode', 'bank', '--powerdown_timeout', '20', '--selfrefresh_timeout', '500']),
+]
+points_options = [(name, 'FRFCFS_CAP', row_policy, options)
+                  for names, options in list_options for name in names for row_policy in ['closed', 'opened']]
+
+
+class ArgumentParser(Tap):
+    update: bool = False  # record the current results as the golden outputs
+    num_processes: int = os.cpu_count()
+
+
+def get_digest(values):
+    return hashlib.sha256(repr(list(values)).encode()).hexdigest()[:16]
+
+
+def get_digests_statistics(rows):
+    # the digest of the values of every statistic, by its name without the node ids
+    values = {}
+    for name, value, _ in rows:
+        values.setdefault(re.sub(r'\b(channel|rank|bankgroup|bank)\d+\.', r'\1.', name), []).append(value)
+    return {name: get_digest(values_name) for name, values_name in values.items()}
+
+
+def run_point(trace_filename, options):
+    # runs in a worker process: the outputs of one simulation
+    import main
+    from configs import sim_help
+    args = main.get_args(['--trace', trace_filename] + options)
+    trace = main.Trace(trace_filename, cpu_tick=args.cpu_tick, mem_tick=args.mem_tick)
+    # keep every request of the trace, in order, to read its departure afterwards
+    requests = []
+    get_trace_request = trace.get_trace_request
+    
+    def get_trace_request_kept():
+        flag_end, request = get_trace_request()
+        if request is not None:
+            requests.append(request)
+        return flag_end, request
+    
+    trace.get_trace_request = get_trace_request_kept
+    with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+        memory = main.simulate(args, main.get_spec(args), trace)
+    counters = sim_help.get_statistics(memory)
+    rows = list(sim_help.get_statistic_group(memory).to_rows(sim_help.list_percentiles))
+    # the exported average latency of a channel is the mean of its histogram
+    values = {name: value for name, value, _ in rows}
+    for name, value in values.items():
+        if name.endswith('.latency_read_avg') and value != values[name[:-len('_avg')] + '.mean']:
+            raise Exception('{} is {}, the histogram mean is {}'.format(
+                name, value, values[name[:-len('_avg')] + '.mean']))
+    return {'cycles': counters.pop('cycle'),
+            'departures': get_digest(request.cycle_depart for request in requests),
+            'statistics': get_digests_statistics(rows),
+            'counters': counters}
+
+
+def compare(output, expected):
+    # the names of the outputs that differ from the golden ones
+    if expected is None:
+        return ['missing']
+    differences = [name for name in ['cycles', 'departures'] if output[name] != expected[name]]
+    differences += ['statistics.' + name for name in sorted(expected['statistics'])
+                    if output['statistics'].get(name) != expected['statistics'][name]]
+    differences += [name for name in sorted(expected['counters'])
+                    if output['counters'].get(name) != expected['counters'][name]]
+    return differences
+
+
+def main(args_):
+    golden = {}
+    if os.path.exists(golden_filename):
+        with open(golden_filename, 'r') as f:
+            golden = json.load(f)
+    
+    points = [point + ([],) for point in itertools.product(corpus, list_schedulers, list_row_policies)]
+    points += points_options
+    with tempfile.TemporaryDirectory() as dirname:
+        for name, (num_requests, seed) in itertools.chain(corpus.items(), corpus_options.items()):
+            generate_trace(os.path.join(dirname, name + '.trace'), name, num_requests, seed)
+        tasks = [(os.path.join(dirname, name + '.trace'),
+                  ['--scheduler', scheduler, '--row_policy', row_policy] + options + mode)
+                 for name, scheduler, row_policy, options in points for mode in list_modes]
+        with multiprocessing.Pool(max(args_.num_processes, 1)) as pool:
+            outputs = pool.starmap(run_point, tasks)
+    
+    results = {}
+    num_failed = 0
+    for (name, scheduler, row_policy, options), mode, output in zip(
+            [point for point in points for _ in list_modes], itertools.cycle(list_modes), outputs):
+        key = ' '.join([name, scheduler, row_policy] + options)
+        # every mode must reproduce the outputs of the reference, and when
+        # updating, those of the first mode
+        expected = results[key] if args_.update and key in results else golden.get(key)
+        differences = compare(output, expected)
+        if len(differences) == 0:
+            status = 'OK'
+        elif args_.update and key not in results:
+            status = 'UPDATED'
+        else:
+            status = 'FAIL ({})'.format(', '.join(differences))
+            num_failed += 1
+        results.setdefault(key, output)
+        print('{:<90} {:>8}  {}'.format(' '.join([key] + mode), output['cycles'], status))
+    
+    if args_.update and num_failed == 0:
+        with open(golden_filename, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+            f.write('\n')
+        return 0
+    print('{} of {} points failed'.format(num_failed, len(outputs)))
+    return 1 if num_failed > 0 else 0
+
+
+if __name__ == '__main__':
+    exit(main(ArgumentParser().parse_args()))
@@ -0,0 +1,89 @@
+# coding=utf-8
+# Sweep of the simulation over a grid of options of main.py, e.g.
+#   python -m sweep.grid --trace dram.trace --grid scheduler=FCFS,FRFCFS row_policy=closed,opened --skip_idle
+# Every point of the product of the grid is simulated on one binary copy of the
+# trace, which the workers memory-map and so share through the page cache. The
+# options that are not in the grid (--skip_idle above) are given to every point.
+# The statistics of all points are written to a single CSV table.
+import os
+import csv
+import time
+import itertools
+import tempfile
+import contextlib
+import multiprocessing
+from typing import List
+from tap import Tap
+import main
+from configs import sim_help
+
+
+class ArgumentParser(Tap):
+    trace: str = 'dram.trace'
+    grid: List[str] = []  # option=value1,value2,... for every swept option of main.py
+    num_processes: int = os.cpu_count()  # the number of points simulated at the same time
+    output: str = 'sweep.csv'
+
+
+def parse_grid(grid):
+    # [(option, [values])] in the given order
+    list_option_values = []
+    for item in grid:
+        if '=' not in item:
+            raise Exception('Bad grid item {}, expected option=value1,value2,...'.format(item))
+        option, values = item.split('=', 1)
+        list_option_values.append((option, values.split(',')))
+    return list_option_values
+
+
+def run_point(trace_filename, point, extra_args):
+    # runs in a worker process, which simulates one point after the other
+    argv = ['--trace', trace_filename] + extra_args
+    for option, value in point:
+        argv += ['--{}'.format(option), value]
+    begin = time.perf_counter()
+    try:
+        args = main.get_args(argv)
+        with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+            memory = main.simulate(args, main.get_spec(args), main.BinaryTrace(trace_filename))
+        stats = sim_help.get_statistics(memory)
+    except (Exception, SystemExit) as e:
+        # bad options exit from the argument parser, too long runs from early_termination
+        stats = {'error': '{}: {}'.format(type(e).__name__, e)}
+    stats['seconds'] = time.perf_counter() - begin
+    return stats
+
+
+def main_sweep(args_, extra_args):
+    list_option_values = parse_grid(args_.grid)
+    options = [option for option, _ in list_option_values]
+    points = [list(zip(options, values))
+              for values in itertools.product(*[values for _, values in list_option_values])]
+    
+    with tempfile.TemporaryDirectory() as dirname:
+        trace_filename = os.path.join(dirname, 'trace.bin')
+        # the arrival cycles are converted with the clock ratio of the options outside the grid
+        args_base = main.get_args(['--trace', args_.trace] + extra_args)
+        main.BinaryTrace.convert(args_.trace, trace_filename, args_base.cpu_tick, args_base.mem_tick)
+        with multiprocessing.Pool(max(args_.num_processes, 1)) as pool:
+            list_stats = pool.starmap(run_point, [(trace_filename, point, extra_args) for point in points])
+    
+    # the columns of the statistics in the order of their first appearance
+    columns = list(options)
+    for stats in list_stats:
+        for name in stats:
+            if name not in columns:
+                columns.append(name)
+    with open(args_.output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for point, stats in zip(points, list_stats):
+            writer.writerow(dict(point, **stats))
+            if 'error' in stats:
+                print('failed: {}: {}'.format(' '.join('{}={}'.format(*item) for item in point), stats['error']))
+    print('{} points written to {}'.format(len(points), args_.output))
+
+
+if __name__ == '__main__':
+    args, extra = ArgumentParser().parse_known_args()
+    main_sweep(args, extra)